@@ -8,20 +8,38 @@ import zipfile
 import requests
 
 from incytr_viz.app import create_dash_app
-from incytr_viz.util import create_logger
+from incytr_viz.registry import DATASET_MEMORY_MB
+from incytr_viz.util import (
+    SANKEY_LINK_BUDGET,
+    SANKEY_NODE_BUDGET,
+    UMAP_POINT_BUDGET,
+    LoadFilter,
+    create_logger,
+)
 
 logger = create_logger(__name__)
 
 
-def run_wsgi(pathways, clusters):
+def run_wsgi(pathways, clusters, server_options=None, **input_options):
+    """
+    server_options: workers, threads and worker_class for the wsgi server, and
+        watch_seconds to poll the input files for changes; unset options use the
+        server's defaults
+    input_options are passed through to IncytrInput; to serve a catalogue of datasets
+        instead, pass pathways and clusters as None and catalogue_dir (and optionally
+        dataset_memory_mb) here
+    """
+    input_options.setdefault("use_cache", True)
+    server_options = {k: v for k, v in (server_options or {}).items() if v is not None}
+
     if os.name == "nt":
         from incytr_viz.wsgi_windows import run_waitress
 
-        run_waitress(pathways, clusters)
+        run_waitress(pathways, clusters, **server_options, **input_options)
     else:
         from incytr_viz.wsgi_posix import run_gunicorn
 
-        run_gunicorn(pathways, clusters)
+        run_gunicorn(pathways, clusters, **server_options, **input_options)
 
 
 def main():
@@ -29,17 +47,181 @@ def main():
     parser.add_argument(
         "--clusters",
         type=str,
-        required=True,
+        default=None,
         help="cell clusters filepath",
     )
-    parser.add_argument("--pathways", type=str, required=True, help="pathways filepath")
+    parser.add_argument("--pathways", type=str, default=None, help="pathways filepath")
+    parser.add_argument(
+        "--catalogue",
+        type=str,
+        default=None,
+        help=(
+            "serve every dataset in this directory, one subdirectory per dataset "
+            "holding its clusters and pathways files, instead of --clusters/--pathways"
+        ),
+    )
+    parser.add_argument(
+        "--dataset-memory-mb",
+        type=float,
+        default=DATASET_MEMORY_MB,
+        help=(
+            "memory budget (MB) for loaded catalogue datasets; the least recently "
+            "used are dropped beyond it"
+        ),
+    )
+    parser.add_argument(
+        "--no-cache",
+        action="store_true",
+        help="do not read or write the pathways cache stored next to the pathways file",
+    )
+    parser.add_argument(
+        "--filter-cache-mb",
+        type=float,
+        default=256,
+        help=(
+            "memory budget (MB) per worker for cached filter results shared between "
+            "callbacks"
+        ),
+    )
+    parser.add_argument(
+        "--umap-point-budget",
+        type=int,
+        default=UMAP_POINT_BUDGET,
+        help="most umap points drawn at once; larger umaps are downsampled and refined on zoom",
+    )
+    parser.add_argument(
+        "--sankey-node-budget",
+        type=int,
+        default=SANKEY_NODE_BUDGET,
+        help="most nodes per layer of the river view; the rest are grouped into an Other node",
+    )
+    parser.add_argument(
+        "--sankey-link-budget",
+        type=int,
+        default=SANKEY_LINK_BUDGET,
+        help="most links in the river view; fewer nodes are kept until the links fit",
+    )
+    parser.add_argument(
+        "--load-workers",
+        type=int,
+        default=None,
+        help="processes used to parse the pathways file (default: number of cores)",
+    )
+    parser.add_argument(
+        "--compact-dtypes",
+        action="store_true",
+        help=(
+            "store scores and umap coordinates as float32 to halve their memory "
+            "(p values stay float64)"
+        ),
+    )
+    parser.add_argument(
+        "--min-sigprob",
+        type=float,
+        default=None,
+        help="only load pathways with at least this sigprob in one of the groups",
+    )
+    parser.add_argument(
+        "--max-p-value",
+        type=float,
+        default=None,
+        help="only load pathways with at most this p value in one of the groups",
+    )
+    parser.add_argument(
+        "--cell-types",
+        nargs="+",
+        default=None,
+        help="only load pathways whose sender and receiver are among these cell types",
+    )
+    parser.add_argument(
+        "--exclude-cell-types",
+        nargs="+",
+        default=None,
+        help="do not load pathways sent or received by these cell types",
+    )
+    parser.add_argument(
+        "--genes",
+        nargs="+",
+        default=None,
+        help="only load pathways involving at least one of these genes",
+    )
+    parser.add_argument(
+        "--exclude-genes",
+        nargs="+",
+        default=None,
+        help="do not load pathways involving any of these genes",
+    )
+    parser.add_argument(
+        "--watch-inputs",
+        type=float,
+        default=None,
+        metavar="SECONDS",
+        help=(
+            "check the input files every SECONDS and reload them in the background "
+            "when they change (SIGHUP also reloads them)"
+        ),
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=None,
+        help="number of gunicorn worker processes sharing the loaded data (default 1)",
+    )
+    parser.add_argument(
+        "--threads",
+        type=int,
+        default=None,
+        help="threads per worker (default 1 for gunicorn, 4 for waitress)",
+    )
+    parser.add_argument(
+        "--worker-class",
+        type=str,
+        default=None,
+        help="gunicorn worker class, e.g. sync or gthread (default sync)",
+    )
 
     args = parser.parse_args()
 
+    if args.catalogue is None and not (args.clusters and args.pathways):
+        parser.error("--clusters and --pathways are required without --catalogue")
+    if args.catalogue is not None and (args.clusters or args.pathways):
+        parser.error("--catalogue cannot be combined with --clusters/--pathways")
+
     PATHWAYS = args.pathways
     CLUSTERS = args.clusters
 
-    run_wsgi(PATHWAYS, CLUSTERS)
+    catalogue_options = (
+        {"catalogue_dir": args.catalogue, "dataset_memory_mb": args.dataset_memory_mb}
+        if args.catalogue is not None
+        else {}
+    )
+
+    run_wsgi(
+        PATHWAYS,
+        CLUSTERS,
+        server_options={
+            "workers": args.workers,
+            "threads": args.threads,
+            "worker_class": args.worker_class,
+            "watch_seconds": args.watch_inputs,
+        },
+        use_cache=not args.no_cache,
+        filter_cache_mb=args.filter_cache_mb,
+        umap_point_budget=args.umap_point_budget,
+        sankey_node_budget=args.sankey_node_budget,
+        sankey_link_budget=args.sankey_link_budget,
+        load_workers=args.load_workers,
+        compact_dtypes=args.compact_dtypes,
+        load_filter=LoadFilter(
+            min_sigprob=args.min_sigprob,
+            max_p_value=args.max_p_value,
+            cell_types=args.cell_types,
+            exclude_cell_types=args.exclude_cell_types,
+            genes=args.genes,
+            exclude_genes=args.exclude_genes,
+        ),
+        **catalogue_options,
+    )
 
 
 def develop():
@@ -1,43 +1,159 @@
 import json
+import uuid
 from typing import Optional
+from urllib.parse import parse_qs, urlencode
 
 import dash_bootstrap_components as dbc
 import numpy as np
 import pandas as pd
-from dash import ALL, Dash, callback, ctx, dcc, html
+from dash import (
+    ALL,
+    Dash,
+    callback,
+    clientside_callback,
+    ctx,
+    dcc,
+    get_relative_path,
+    html,
+)
 from dash.dependencies import Input, Output, State
-from flask import current_app
+from dash.exceptions import PreventUpdate
+from flask import Response, current_app, request, stream_with_context
 
 from incytr_viz.components import (
     create_hist_figure,
     cytoscape_container,
     filter_container,
+    hist_counts_patch,
+    histogram_columns,
     sankey_container,
     slider_container,
     umap_graph,
+    umap_points_patch,
 )
+from incytr_viz.export import export_formats, stream_export_archive
+from incytr_viz.registry import DATASET_MEMORY_MB, DatasetRegistry
+from incytr_viz.reload import ReloadableInput
 from incytr_viz.util import *
 
 logger = create_logger(__name__)
 
 
-def create_dash_app(pathways_file, clusters_file):
+def _create_dash():
     app = Dash(
         __name__,
         suppress_callback_exceptions=True,
         external_stylesheets=[dbc.themes.BOOTSTRAP],
     )
 
-    incytr_input = IncytrInput(clusters_path=clusters_file, pathways_path=pathways_file)
+    @app.server.route(app.config.routes_pathname_prefix + "download", methods=["POST"])
+    def download_pathways():
+        try:
+            export_request = json.loads(request.form["request"])
+        except (KeyError, ValueError):
+            export_request = None
+        if not isinstance(export_request, dict) or "filter" not in export_request:
+            return Response(
+                "Expected an export request (json with a filter) in the request field",
+                status=400,
+            )
+        try:
+            incytr_input = get_incytr_input(export_request.get("dataset"))
+        except KeyError as e:
+            return Response(str(e), status=404)
+        return export_response(incytr_input, export_request)
 
-    app.server.config["INCYTR_INPUT"] = incytr_input
+    return app
 
-    defaults = {**filter_defaults(), **view_defaults()}
+
+def create_dash_app(pathways_file, clusters_file, **input_options):
+    app = _create_dash()
+
+    dataset = ReloadableInput(clusters_file, pathways_file, **input_options)
+
+    app.server.config["INCYTR_DATASET"] = dataset
+    # built per page load, so pages opened after a reload show the new data
+    app.layout = lambda: dataset_layout(dataset.current)
+
+    return app
+
+
+def create_catalogue_app(
+    catalogue_dir, dataset_memory_mb=DATASET_MEMORY_MB, **input_options
+):
+    """
+    App serving every dataset of a catalogue directory (see incytr_viz.registry); the
+    dataset shown is picked in the navbar and kept in the url
+    """
+    app = _create_dash()
+
+    app.server.config["INCYTR_REGISTRY"] = DatasetRegistry(
+        catalogue_dir, max_memory_mb=dataset_memory_mb, **input_options
+    )
 
     app.layout = html.Div(
+        [
+            dcc.Location(id="url", refresh=False),
+            dcc.Loading(html.Div(id="dataset-page"), delay_show=500),
+        ]
+    )
+
+    return app
+
+
+def input_source(server) -> "ReloadableInput | DatasetRegistry":
+    """Where an app's data comes from: its one dataset, or its catalogue"""
+    if "INCYTR_REGISTRY" in server.config:
+        return server.config["INCYTR_REGISTRY"]
+    return server.config["INCYTR_DATASET"]
+
+
+def get_incytr_input(dataset=None) -> IncytrInput:
+    """
+    The dataset a request is for: the app's only one, or the named catalogue dataset
+
+    Callbacks look it up once, so a request finishes against the data it started with
+    even if a reload swaps in new data meanwhile
+    """
+    registry = current_app.config.get("INCYTR_REGISTRY")
+    if registry is None:
+        return current_app.config["INCYTR_DATASET"].current
+    return registry.get(dataset)
+
+
+def dataset_layout(incytr_input, dataset=None, datasets=None):
+    """
+    Page for one dataset
+
+    dataset, datasets: name of the dataset shown and of every dataset to choose from,
+        for a catalogue app
+    """
+    defaults = {**filter_defaults(), **view_defaults()}
+
+    # bin edges are fixed per dataset, so both histograms start from one skeleton and
+    # update_figure_and_histogram only sends the counts
+    hist_columns = histogram_columns(
+        has_tpds=incytr_input.has_tpds,
+        has_ppds=incytr_input.has_ppds,
+        has_p_value=incytr_input.has_p_value,
+    )
+    hist_figure = create_hist_figure(
+        {c: incytr_input.filter_engine.histogram_edges(c) for c in hist_columns}
+    )
+
+    return html.Div(
         [
             dbc.NavbarSimple(
                 children=[
+                    dbc.NavItem(
+                        dbc.Select(
+                            id="dataset-select",
+                            options=[{"label": d, "value": d} for d in datasets or []],
+                            value=dataset,
+                            size="sm",
+                        ),
+                        style={} if datasets else {"display": "none"},
+                    ),
                     dbc.NavItem(
                         html.Div(
                             dbc.RadioItems(
@@ -175,6 +291,21 @@ def create_dash_app(pathways_file, clusters_file):
                         size="xl",
                         is_open=False,
                     ),
+                    dbc.NavItem(
+                        dbc.Select(
+                            id="download-format",
+                            options=[
+                                {"label": f.upper(), "value": f}
+                                for f in export_formats()
+                            ],
+                            value="csv",
+                            size="sm",
+                        ),
+                        # csv is the only choice without pyarrow
+                        style=(
+                            {} if len(export_formats()) > 1 else {"display": "none"}
+                        ),
+                    ),
                     dbc.NavItem(
                         html.Button(
                             "Download Current Paths",
@@ -182,8 +313,10 @@ def create_dash_app(pathways_file, clusters_file):
                             className="btn btn-primary",
                         ),
                     ),
-                    dcc.Download(id="download-dataframe-a-csv"),
-                    dcc.Download(id="download-dataframe-b-csv"),
+                    dcc.Store(id="download-request"),
+                    html.Div(id="download-submitted", hidden=True),
+                    dcc.Store(id="session-id", storage_type="session"),
+                    dcc.Store(id="dataset-name", data=dataset),
                 ],
                 brand="Incytr Pathway Visualization",
                 brand_href="#",
@@ -240,9 +373,8 @@ def create_dash_app(pathways_file, clusters_file):
                                     className="groupHeader",
                                 ),
                                 html.Div(
-                                    umap_graph(
-                                        "a", incytr_input.has_umap, incytr_input.paths
-                                    ),
+                                    # filled in by load_umap when first shown
+                                    [],
                                     className="umapContainer",
                                     id="umap-a-container",
                                     style=(
@@ -257,7 +389,12 @@ def create_dash_app(pathways_file, clusters_file):
                                             [dcc.Graph()], id="figure-a-container"
                                         ),
                                         html.Div(
-                                            [dcc.Graph(id="hist-a-graph")],
+                                            [
+                                                dcc.Graph(
+                                                    id="hist-a-graph",
+                                                    figure=hist_figure,
+                                                )
+                                            ],
                                             id="hist-a-container",
                                             className="histContainer",
                                         ),
@@ -294,9 +431,8 @@ def create_dash_app(pathways_file, clusters_file):
                                     className="groupHeader",
                                 ),
                                 html.Div(
-                                    umap_graph(
-                                        "b", incytr_input.has_umap, incytr_input.paths
-                                    ),
+                                    # filled in by load_umap when first shown
+                                    [],
                                     className="umapContainer",
                                     id="umap-b-container",
                                     style=(
@@ -311,7 +447,12 @@ def create_dash_app(pathways_file, clusters_file):
                                             [dcc.Graph()], id="figure-b-container"
                                         ),
                                         html.Div(
-                                            [dcc.Graph(id="hist-b-graph")],
+                                            [
+                                                dcc.Graph(
+                                                    id="hist-b-graph",
+                                                    figure=hist_figure,
+                                                )
+                                            ],
                                             id="hist-b-container",
                                             className="histContainer",
                                         ),
@@ -333,11 +474,54 @@ def create_dash_app(pathways_file, clusters_file):
         className="app",
     )
 
-    return app
 
+def export_response(incytr_input, export_request: dict):
+    """Streamed zip of both groups' pathways for a download request (see download)"""
+
+    fmt = export_request.get("format", "csv")
+    if fmt not in export_formats():
+        return Response(f"Unsupported export format {fmt}", status=400)
+
+    pf = PathwaysFilter.from_filter_state(incytr_input, export_request["filter"])
+    group_results = [
+        (
+            name,
+            group_id,
+            pf.filter_result(group_id, should_filter_umap=incytr_input.has_umap),
+        )
+        for name, group_id in [
+            (incytr_input.group_a, "a"),
+            (incytr_input.group_b, "b"),
+        ]
+    ]
+
+    fname = f"{incytr_input.group_a}_{incytr_input.group_b}_pathways.zip"
+    return Response(
+        stream_with_context(
+            stream_export_archive(incytr_input.filter_engine, group_results, fmt)
+        ),
+        mimetype="application/zip",
+        headers={"Content-Disposition": f'attachment; filename="{fname}"'},
+    )
+
+
+def create_app(
+    pathways_file=None, clusters_file=None, catalogue_dir=None, **input_options
+):
+    if catalogue_dir is not None:
+        return create_catalogue_app(catalogue_dir, **input_options).server
+    return create_dash_app(pathways_file, clusters_file, **input_options).server
+
+
+def elements_from_columns(columns: dict) -> list[dict]:
+    """
+    Build cytoscape elements from equal length columns of element data
 
-def create_app(pathways_file, clusters_file):
-    return create_dash_app(pathways_file, clusters_file).server
+    columns: dict of {data key: array-like}, one value per element
+    """
+    keys = list(columns.keys())
+    values = [np.asarray(v).tolist() for v in columns.values()]
+    return [{"data": dict(zip(keys, row))} for row in zip(*values)]
 
 
 def load_nodes(clusters: pd.DataFrame, node_scale_factor) -> list[dict]:
@@ -387,33 +571,23 @@ def load_nodes(clusters: pd.DataFrame, node_scale_factor) -> list[dict]:
 
     clusters = calculate_node_diameters(clusters, node_scale_factor)
 
-    def _add_node(row: pd.Series) -> dict:
-
-        node_type = row.name
-        node_label = row.type_userlabel
-        node_population = row["population"]
+    # NaN populations are dropped, None populations are shown without a size
+    is_none = clusters["population"].map(lambda x: x is None).astype(bool)
+    clusters = clusters[clusters["population"].notna() | is_none]
+    stringified_population = clusters["population"].map(
+        lambda x: "" if x is None else f"{x:.0f}"
+    )
 
-        if node_population == None:
-            stringified_population = ""
-        elif np.isnan(node_population):
-            return np.nan
-        else:
-            stringified_population = f"{node_population:.0f}"
-
-        data = dict()
-        data["id"] = node_type
-        data["label"] = node_label
-        data["label_with_size"] = f"{node_label} ({stringified_population})"
-        data["width"] = row["node_diameter"]
-        data["height"] = row["node_diameter"]
-        data["background_color"] = row["color"]
-        return {"data": data}
-
-    return list(
-        clusters.apply(
-            lambda row: _add_node(row),
-            axis=1,
-        ).dropna()
+    labels = clusters["type_userlabel"]
+    return elements_from_columns(
+        {
+            "id": clusters.index,
+            "label": labels,
+            "label_with_size": labels + " (" + stringified_population + ")",
+            "width": clusters["node_diameter"],
+            "height": clusters["node_diameter"],
+            "background_color": clusters["color"],
+        }
     )
 
 
@@ -422,118 +596,156 @@ def load_edges(
     pathways: pd.DataFrame,
     global_max_paths: int,
     edge_scale_factor: float,
+    sender_receiver_counts: pd.Series = None,
 ):
-    """add pathways from source to target"""
+    """
+    add pathways from source to target
+
+    sender_receiver_counts: precomputed pathways per (sender, receiver), e.g. from
+        PathwaysFilterEngine.sender_receiver_counts; counted from pathways if omitted
+    """
     edges = []
 
-    ## filter pathways if sender/receiver not in nodes
     node_ids = pd.Series([x["data"]["id"] for x in nodes])
-    pathways = pathways[
-        (pathways["sender"].isin(node_ids)) & (pathways["receiver"].isin(node_ids))
-    ]
-
-    ## filter pathways that are below sigprob threshold
-
-    if len(pathways) == 0:
-        return edges
 
-    s: pd.Series = pathways.groupby(["sender", "receiver"]).size()
+    if sender_receiver_counts is None:
+        ## filter pathways if sender/receiver not in nodes
+        pathways = pathways[
+            (pathways["sender"].isin(node_ids)) & (pathways["receiver"].isin(node_ids))
+        ]
 
-    sr_pairs = s.to_dict()
-    for sr, weight in sr_pairs.items():
-        source_id, target_id = sr
-        data = dict()
-        data["id"] = source_id + target_id
-        data["source"] = source_id
-        data["target"] = target_id
-        data["weight"] = weight
-        data["label"] = str(weight)
-        data["line_color"] = next(
-            x["data"]["background_color"] for x in nodes if x["data"]["id"] == source_id
-        )
+        if len(pathways) == 0:
+            return edges
 
-        edges.append({"data": data})
+        s: pd.Series = pathways.groupby(["sender", "receiver"], observed=True).size()
+    else:
+        s = sender_receiver_counts
+        s = s[
+            s.index.get_level_values("sender").isin(node_ids)
+            & s.index.get_level_values("receiver").isin(node_ids)
+        ]
 
-    if edges:
-        for e in edges:
-            e["data"]["width"] = edge_width_map(
-                abs(e["data"]["weight"]),
+        if len(s) == 0:
+            return edges
+
+    node_colors = {x["data"]["id"]: x["data"]["background_color"] for x in nodes}
+    source_ids = s.index.get_level_values("sender").astype(str)
+    target_ids = s.index.get_level_values("receiver").astype(str)
+    weights = s.to_numpy()
+
+    return elements_from_columns(
+        {
+            "id": source_ids + target_ids,
+            "source": source_ids,
+            "target": target_ids,
+            "weight": weights,
+            "label": weights.astype(str),
+            "line_color": source_ids.map(node_colors),
+            "width": edge_width_map(
+                np.abs(weights),
                 edge_scale_factor=edge_scale_factor,
                 global_max_paths=global_max_paths,
-            )
+            ),
+        }
+    )
+
+
+def sankey_kinase_colors(
+    df: pd.DataFrame, source_colname: str, target_colname: str
+) -> np.ndarray:
+    """Link color for each row from the kinase relationship between adjacent components"""
+
+    mapper = kinase_color_map()
+
+    if (source_colname == "receptor") and (target_colname == "em"):
+        forward, reverse = "sik_r_of_em", "sik_em_of_r"
+        forward_color = mapper["Receptor --> EM"]
+        reverse_color = mapper["EM --> (Receptor/Target Gene)"]
+    elif (source_colname == "em") and (target_colname == "target"):
+        forward, reverse = "sik_em_of_t", "sik_t_of_em"
+        forward_color = mapper["EM --> (Receptor/Target Gene)"]
+        reverse_color = mapper["Target --> EM"]
+    else:
+        return np.full(len(df), "lightgrey", dtype=object)
+
+    if KINASE_BITS_COLUMN not in df.columns:
+        return np.full(len(df), "lightgrey", dtype=object)
 
-    return edges
+    bits = df[KINASE_BITS_COLUMN].to_numpy()
+    has_forward = (bits & kinase_bit(forward)) != 0
+    has_reverse = (bits & kinase_bit(reverse)) != 0
+
+    return np.select(
+        [has_forward & has_reverse, has_forward, has_reverse],
+        [mapper["Bidirectional"], forward_color, reverse_color],
+        default="lightgrey",
+    ).astype(object)
+
+
+def sankey_link_keys(
+    df: pd.DataFrame, layer_pairs: list, sankey_color_flow: Optional[str] = None
+) -> dict:
+    """Per pair of layers, the integer per row that _get_values splits links by"""
+    if sankey_color_flow in ["sender", "receiver"]:
+        key = pd.factorize(df[sankey_color_flow])[0]
+        return {pair: key for pair in layer_pairs}
+    elif sankey_color_flow == "kinase":
+        return {
+            pair: pd.factorize(sankey_kinase_colors(df, *pair))[0]
+            for pair in layer_pairs
+        }
+    return {pair: np.zeros(len(df), dtype=np.int64) for pair in layer_pairs}
 
 
 def pathways_df_to_sankey(
     sankey_df: pd.DataFrame,
     all_clusters: pd.DataFrame,
     sankey_color_flow: Optional[str] = None,  # sender or receiver
+    node_budget=SANKEY_NODE_BUDGET,
+    link_budget=SANKEY_LINK_BUDGET,
 ) -> tuple:
+    """
+    Sankey nodes and links of the pathways, the number of nodes folded into "Other"
+    nodes per layer last (see fold_sankey_nodes)
+    """
+
+    cluster_colors = dict(zip(all_clusters.index, all_clusters["color"]))
 
     def _get_values(
         df: pd.DataFrame, source_colname: str, target_colname: str
     ) -> pd.DataFrame:
 
-        def _kinase_color_map(row, source, target):
-
-            mapper = kinase_color_map()
-            if (source == "receptor") and (target == "em"):
-                if row["sik_r_of_em"] and row["sik_em_of_r"]:
-                    return mapper["Bidirectional"]
-                elif row["sik_r_of_em"]:
-                    return mapper["Receptor --> EM"]
-                elif row["sik_em_of_r"]:
-                    return mapper["EM --> (Receptor/Target Gene)"]
-            elif (source == "em") and (target == "target"):
-                if row["sik_em_of_t"] and row["sik_t_of_em"]:
-                    return mapper["Bidirectional"]
-                elif row["sik_em_of_t"]:
-                    return mapper["EM --> (Receptor/Target Gene)"]
-                elif row["sik_t_of_em"]:
-                    return mapper["Target --> EM"]
-            return "lightgrey"
-
         if sankey_color_flow in ["sender", "receiver"]:
             color_grouping_column = sankey_color_flow
             out = (
-                df.groupby([source_colname, color_grouping_column])[target_colname]
-                .value_counts()
+                df.groupby(
+                    [source_colname, color_grouping_column, target_colname],
+                    observed=True,
+                )
+                .size()
                 .reset_index(name="value")
             )
-            out[color_grouping_column] = (
-                out[color_grouping_column].astype(str).str.lower()
-            )
-            out["color"] = out[color_grouping_column].map(
-                dict(zip(all_clusters.index, all_clusters["color"]))
+            out["color"] = (
+                out[color_grouping_column].astype(str).str.lower().map(cluster_colors)
             )
         elif sankey_color_flow == "kinase":
-
-            # only coloring adjacent
-            adjacent_kinase_cols = [
-                "sik_r_of_em",
-                "sik_em_of_r",
-                "sik_em_of_t",
-                "sik_t_of_em",
-            ]
-
-            kinase_mask = df[adjacent_kinase_cols].any(axis=1)
-            df.loc[kinase_mask, "kinase_color_map"] = df.loc[kinase_mask].apply(
-                lambda row: _kinase_color_map(row, source_colname, target_colname),
-                axis=1,
+            kinase_colors = pd.Series(
+                sankey_kinase_colors(df, source_colname, target_colname),
+                index=df.index,
+                name="color",
             )
-            df.loc[~kinase_mask, "kinase_color_map"] = "lightgrey"
             out = (
-                df.groupby([source_colname, "kinase_color_map"])[target_colname]
-                .value_counts()
+                df.groupby(
+                    [df[source_colname], kinase_colors, df[target_colname]],
+                    observed=True,
+                )
+                .size()
                 .reset_index(name="value")
             )
-            out["color"] = out["kinase_color_map"]
-
         else:
             out = (
-                df.groupby([source_colname])[target_colname]
-                .value_counts()
+                df.groupby([source_colname, target_colname], observed=True)
+                .size()
                 .reset_index(name="value")
             )
             out["color"] = "lightgrey"
@@ -545,38 +757,38 @@ def pathways_df_to_sankey(
             },
             inplace=True,
         )
-        out["source_id"] = out["source"] + "_" + source_colname
-        out["target_id"] = out["target"] + "_" + target_colname
+        out["source_id"] = out["source"].astype(str) + "_" + source_colname
+        out["target_id"] = out["target"].astype(str) + "_" + target_colname
 
         return out
 
-    l_r = _get_values(sankey_df, "ligand", "receptor")
-    r_em = _get_values(sankey_df, "receptor", "em")
-    em_t = _get_values(sankey_df, "em", "target")
+    layer_pairs = [("ligand", "receptor"), ("receptor", "em"), ("em", "target")]
 
-    included_links = [l_r, r_em]
-
-    ## auto-determine if target genes should be included
-    def _should_display_targets() -> bool:
-        num_targets = len(em_t["target"].unique())
-
-        return num_targets <= 400
-        # return True
+    # large rivers keep their busiest nodes, so render time stays bounded
+    sankey_df, folded = fold_sankey_nodes(
+        sankey_df,
+        sankey_link_keys(sankey_df, layer_pairs, sankey_color_flow),
+        node_budget=node_budget,
+        link_budget=link_budget,
+    )
 
-    if _should_display_targets():
-        included_links.append(em_t)
+    links = pd.concat(
+        [_get_values(sankey_df, *pair) for pair in layer_pairs], axis=0
+    ).reset_index(drop=True)
 
-    links = pd.concat(included_links, axis=0).reset_index(drop=True)
     # ids allow for repeating labels in ligand, receptor, etc. without pointing to same node
-    ids = list(set(pd.concat([links["source_id"], links["target_id"]])))
+    node_index, ids = pd.factorize(
+        pd.concat([links["source_id"], links["target_id"]], ignore_index=True)
+    )
+    ids = list(ids)
     labels = [x.split("_")[0] for x in ids]
 
-    source = [next(i for i, e in enumerate(ids) if e == x) for x in links["source_id"]]
-    target = [next(i for i, e in enumerate(ids) if e == x) for x in links["target_id"]]
+    source = node_index[: len(links)].tolist()
+    target = node_index[len(links) :].tolist()
     value = links["value"]
 
     color = links["color"]
-    return (ids, labels, source, target, value, color)
+    return (ids, labels, source, target, value, color, folded)
 
 
 def pathway_component_filter_inputs(state=False):
@@ -597,6 +809,34 @@ def pathway_component_filter_inputs(state=False):
     )
 
 
+def pathways_filter_from_inputs(incytr_input, pcf, sliders_container_children):
+    """PathwaysFilter for the current dropdown and slider values"""
+
+    slider_values = parse_slider_values_from_tree(sliders_container_children)
+
+    return PathwaysFilter(
+        all_paths=incytr_input.paths,
+        group_a_name=incytr_input.group_a,
+        group_b_name=incytr_input.group_b,
+        engine=incytr_input.filter_engine,
+        filter_afc_direction=pcf.get("restrict_afc"),
+        filter_umap_a=parse_umap_filter_data(pcf.get("umap_select_a")),
+        filter_umap_b=parse_umap_filter_data(pcf.get("umap_select_b")),
+        filter_senders=pcf.get("sender_select"),
+        filter_receivers=pcf.get("receiver_select"),
+        filter_ligands=pcf.get("ligand_select"),
+        filter_receptors=pcf.get("receptor_select"),
+        filter_kinase=pcf.get("kinase_select"),
+        filter_em=pcf.get("em_select"),
+        filter_target_genes=pcf.get("target_select"),
+        filter_all_molecules=pcf.get("any_role_select"),
+        ppds_bounds=incytr_input.has_ppds and slider_values.get("ppds"),
+        sp_threshold=slider_values.get("sigprob"),
+        tppds_bounds=incytr_input.has_tpds and slider_values.get("tpds"),
+        pval_threshold=incytr_input.has_p_value and slider_values.get("p-value"),
+    )
+
+
 def network_style_inputs(state=False):
     klass = State if state else Input
     return dict(
@@ -624,6 +864,8 @@ def network_style_inputs(state=False):
     ),
     state=dict(
         show_network_weights=State("show-network-weights", "value"),
+        session_id=State("session-id", "data"),
+        dataset=State("dataset-name", "data"),
     ),
     # prevent_initial_call=True,
 )
@@ -634,42 +876,29 @@ def update_figure_and_histogram(
     sliders_container_children,
     view_radio,
     show_network_weights,
+    session_id,
+    dataset,
 ):
 
-    incytr_input = current_app.config["INCYTR_INPUT"]
+    incytr_input = get_incytr_input(dataset)
     clusters = incytr_input.clusters
 
-    filter_umap_a = parse_umap_filter_data(pcf.get("umap_select_a"))
-    filter_umap_b = parse_umap_filter_data(pcf.get("umap_select_b"))
-
-    slider_values = parse_slider_values_from_tree(sliders_container_children)
+    pf = pathways_filter_from_inputs(incytr_input, pcf, sliders_container_children)
 
-    pf = PathwaysFilter(
-        all_paths=incytr_input.paths,
-        group_a_name=incytr_input.group_a,
-        group_b_name=incytr_input.group_b,
-        filter_afc_direction=pcf.get("restrict_afc"),
-        filter_umap_a=filter_umap_a,
-        filter_umap_b=filter_umap_b,
-        filter_senders=pcf.get("sender_select"),
-        filter_receivers=pcf.get("receiver_select"),
-        filter_ligands=pcf.get("ligand_select"),
-        filter_receptors=pcf.get("receptor_select"),
-        filter_kinase=pcf.get("kinase_select"),
-        filter_em=pcf.get("em_select"),
-        filter_target_genes=pcf.get("target_select"),
-        filter_all_molecules=pcf.get("any_role_select"),
-        ppds_bounds=incytr_input.has_ppds and slider_values.get("ppds"),
-        sp_threshold=slider_values.get("sigprob"),
-        tppds_bounds=incytr_input.has_tpds and slider_values.get("tpds"),
-        pval_threshold=incytr_input.has_p_value and slider_values.get("p-value"),
+    # session_id lets the engine refine this tab's previous result incrementally
+    a_result = pf.filter_result(
+        "a", should_filter_umap=incytr_input.has_umap, session_id=session_id
+    )
+    b_result = pf.filter_result(
+        "b", should_filter_umap=incytr_input.has_umap, session_id=session_id
     )
 
-    a_pathways = pf.filter(
-        "a", should_filter_umap=incytr_input.has_umap and bool(filter_umap_a)
+    # figures need neither the path keys nor the kinase names
+    a_pathways = incytr_input.filter_engine.group_frame(
+        "a", a_result.rows, display_columns=False
     )
-    b_pathways = pf.filter(
-        "b", should_filter_umap=incytr_input.has_umap and bool(filter_umap_b)
+    b_pathways = incytr_input.filter_engine.group_frame(
+        "b", b_result.rows, display_columns=False
     )
 
     def _get_group_figures(
@@ -678,6 +907,8 @@ def update_figure_and_histogram(
         group_name: str,
         group_id: str,
         global_max_paths: int,
+        sender_receiver_counts: pd.Series,
+        result: FilterResult,
     ):
 
         if view_radio == "network":
@@ -692,6 +923,7 @@ def update_figure_and_histogram(
                 edge_scale_factor=nsi.get(
                     "edge_scale_factor",
                 ),
+                sender_receiver_counts=sender_receiver_counts,
             )
 
             cytoscape = cytoscape_container(
@@ -704,10 +936,12 @@ def update_figure_and_histogram(
 
         elif view_radio == "sankey":
 
-            ids, labels, source, target, value, color = pathways_df_to_sankey(
+            ids, labels, source, target, value, color, folded = pathways_df_to_sankey(
                 sankey_df=filtered_group_paths,
                 sankey_color_flow=pcf.get("sankey_color_flow"),
                 all_clusters=clusters,
+                node_budget=incytr_input.sankey_node_budget,
+                link_budget=incytr_input.sankey_link_budget,
             )
 
             sankey = sankey_container(
@@ -720,21 +954,27 @@ def update_figure_and_histogram(
                 color,
                 group_id,
                 color_flow=pcf.get("sankey_color_flow"),
+                folded=folded,
             )
 
             graph_container = sankey
         return [
             graph_container,
-            create_hist_figure(
-                paths=filtered_group_paths,
-                has_tpds=incytr_input.has_tpds,
-                has_ppds=incytr_input.has_ppds,
-                has_p_value=incytr_input.has_p_value,
+            hist_counts_patch(
+                histogram_columns(
+                    has_tpds=incytr_input.has_tpds,
+                    has_ppds=incytr_input.has_ppds,
+                    has_p_value=incytr_input.has_p_value,
+                ),
+                incytr_input.filter_engine.histograms(group_id, result),
             ),
         ]
 
-    a_max_paths = np.max(a_pathways.groupby(["sender", "receiver"]).size())
-    b_max_paths = np.max(b_pathways.groupby(["sender", "receiver"]).size())
+    a_counts = incytr_input.filter_engine.sender_receiver_counts(a_result)
+    b_counts = incytr_input.filter_engine.sender_receiver_counts(b_result)
+
+    a_max_paths = np.max(a_counts)
+    b_max_paths = np.max(b_counts)
 
     if np.isnan(a_max_paths):
         a_max_paths = 0
@@ -749,6 +989,8 @@ def update_figure_and_histogram(
         global_max_paths=global_max_paths,
         group_name=incytr_input.group_a,
         group_id="a",
+        sender_receiver_counts=a_counts,
+        result=a_result,
     )
     group_b_figs = _get_group_figures(
         filtered_group_paths=b_pathways,
@@ -756,6 +998,8 @@ def update_figure_and_histogram(
         global_max_paths=global_max_paths,
         group_name=incytr_input.group_b,
         group_id="b",
+        sender_receiver_counts=b_counts,
+        result=b_result,
     )
     num_paths_a = len(a_pathways)
     num_paths_b = len(b_pathways)
@@ -770,6 +1014,56 @@ def update_figure_and_histogram(
     )
 
 
+@callback(
+    Output("dataset-page", "children"),
+    Input("url", "search"),
+)
+def show_dataset(search):
+    """Page of the catalogue dataset named in the url, else of the default dataset"""
+    registry: DatasetRegistry = current_app.config["INCYTR_REGISTRY"]
+
+    datasets = registry.names()
+    dataset = parse_qs((search or "").lstrip("?")).get("dataset", [None])[0]
+    dataset = dataset or registry.default()
+
+    if dataset is None:
+        return dbc.Alert(f"No datasets found in {registry.catalogue_dir}", color="info")
+    if dataset not in datasets:
+        return dbc.Alert(f"No dataset named {dataset}", color="danger")
+
+    try:
+        incytr_input = registry.get(dataset)
+    except Exception as e:
+        logger.exception(f"Could not load dataset {dataset}")
+        return dbc.Alert(f"Could not load dataset {dataset}: {e}", color="danger")
+
+    return dataset_layout(incytr_input, dataset=dataset, datasets=datasets)
+
+
+@callback(
+    Output("url", "search"),
+    Input("dataset-select", "value"),
+    State("dataset-name", "data"),
+    prevent_initial_call=True,
+)
+def select_dataset(value, dataset):
+    if not value or value == dataset:
+        raise PreventUpdate
+    return "?" + urlencode({"dataset": value})
+
+
+@callback(
+    Output("session-id", "data"),
+    Input("session-id", "modified_timestamp"),
+    State("session-id", "data"),
+)
+def init_session_id(modified_timestamp, session_id):
+    """Assign each browser tab an id for per-session incremental filtering"""
+    if session_id:
+        raise PreventUpdate
+    return uuid.uuid4().hex
+
+
 def _relayout_umap(relayoutData):
     """
     {
@@ -807,6 +1101,81 @@ def relayout_umap_b(
     return _relayout_umap(relayoutData)
 
 
+@callback(
+    Output("umap-a-container", "children"),
+    Output("umap-b-container", "children"),
+    Input("show-umap", "value"),
+    Input("restrict-afc", "value"),
+    State("umap-a-container", "children"),
+    State("dataset-name", "data"),
+)
+def load_umap(show_umap, restrict_afc, current_children, dataset):
+    """
+    Build each group's umap the first time the panel is shown, and again when the afc
+    direction restriction changes
+    """
+    incytr_input = get_incytr_input(dataset)
+
+    if not (show_umap and incytr_input.has_umap):
+        raise PreventUpdate
+    if current_children and ctx.triggered_id != "restrict-afc":
+        raise PreventUpdate
+
+    # large umaps start from a downsample and are refined on zoom (refine_umap_a/b)
+    return [
+        umap_graph(
+            group_id,
+            incytr_input.has_umap,
+            incytr_input.filter_engine.umap_points(
+                incytr_input.umap_level_of_detail(group_id, restrict_afc).rows()
+            ),
+        )
+        for group_id in ["a", "b"]
+    ]
+
+
+def _refine_umap(group_id, relayoutData, restrict_afc, dataset):
+    incytr_input = get_incytr_input(dataset)
+    if not incytr_input.has_umap:
+        raise PreventUpdate
+
+    lod = incytr_input.umap_level_of_detail(group_id, restrict_afc)
+
+    # data within the point budget is drawn in full from the start
+    if not lod.downsampled:
+        raise PreventUpdate
+
+    viewport = umap_viewport(relayoutData)
+    if viewport is None:
+        raise PreventUpdate
+
+    return umap_points_patch(
+        incytr_input.filter_engine.umap_points(lod.rows(*viewport))
+    )
+
+
+@callback(
+    Output("umap-graph-a", "figure"),
+    Input("umap-graph-a", "relayoutData"),
+    State("restrict-afc", "value"),
+    State("dataset-name", "data"),
+    prevent_initial_call=True,
+)
+def refine_umap_a(relayoutData, restrict_afc, dataset):
+    return _refine_umap("a", relayoutData, restrict_afc, dataset)
+
+
+@callback(
+    Output("umap-graph-b", "figure"),
+    Input("umap-graph-b", "relayoutData"),
+    State("restrict-afc", "value"),
+    State("dataset-name", "data"),
+    prevent_initial_call=True,
+)
+def refine_umap_b(relayoutData, restrict_afc, dataset):
+    return _refine_umap("b", relayoutData, restrict_afc, dataset)
+
+
 @callback(
     Output("umap-a-container", "style"),
     Output("umap-b-container", "style"),
@@ -919,7 +1288,10 @@ def update_filters_click_node(
             customdata = click_data["points"][0]["customdata"]
             node_label = customdata.split("_")[0]
             node_type = customdata.split("_")[1]
-            if node_type == "ligand":
+            if node_label.startswith(SANKEY_OTHER_LABEL + " ("):
+                # a folded node stands for many genes, none of them selected
+                pass
+            elif node_type == "ligand":
                 ligand_select = _update(ligand_select, node_label)
             elif node_type == "receptor":
                 receptor_select = _update(receptor_select, node_label)
@@ -962,14 +1334,15 @@ def update_filters_click_node(nclicks):
 
 
 @callback(
-    Output("download-dataframe-a-csv", "data"),
-    Output("download-dataframe-b-csv", "data"),
+    Output("download-request", "data"),
     inputs=dict(
         n_clicks=Input("btn_csv", "n_clicks"),
     ),
     state=dict(
         pcf=pathway_component_filter_inputs(state=True),
         sliders_container_children=State("allSlidersContainer", "children"),
+        fmt=State("download-format", "value"),
+        dataset=State("dataset-name", "data"),
     ),
     prevent_initial_call=True,
 )
@@ -977,40 +1350,57 @@ def download(
     n_clicks: int,
     pcf: dict,
     sliders_container_children,
+    fmt: str = "csv",
+    dataset: str = None,
 ):
+    """
+    Request for the export route; the clientside callback below posts it, so the
+    browser downloads the streamed archive directly rather than through a callback
+    """
 
-    incytr_input = current_app.config["INCYTR_INPUT"]
-
-    if n_clicks and n_clicks > 0:
-
-        slider_values = parse_slider_values_from_tree(sliders_container_children)
-        pf = PathwaysFilter(
-            all_paths=incytr_input.paths,
-            group_a_name=incytr_input.group_a,
-            group_b_name=incytr_input.group_b,
-            filter_afc_direction=pcf.get("restrict_afc"),
-            filter_umap_a=parse_umap_filter_data(pcf.get("umap_select_a")),
-            filter_umap_b=parse_umap_filter_data(pcf.get("umap_select_b")),
-            filter_senders=pcf.get("sender_select"),
-            filter_receivers=pcf.get("receiver_select"),
-            filter_ligands=pcf.get("ligand_select"),
-            filter_receptors=pcf.get("receptor_select"),
-            filter_em=pcf.get("em_select"),
-            filter_target_genes=pcf.get("target_select"),
-            filter_all_molecules=pcf.get("any_role_select"),
-            ppds_bounds=incytr_input.has_ppds and slider_values.get("ppds"),
-            sp_threshold=slider_values.get("sigprob"),
-            tppds_bounds=incytr_input.has_tpds and slider_values.get("tpds"),
-            pval_threshold=incytr_input.has_p_value and slider_values.get("p-value"),
-        )
+    incytr_input = get_incytr_input(dataset)
 
-        a_pathways = pf.filter("a", should_filter_umap=incytr_input.has_umap)
-        b_pathways = pf.filter("b", should_filter_umap=incytr_input.has_umap)
+    if not (n_clicks and n_clicks > 0):
+        raise PreventUpdate
 
-        return (
-            dcc.send_data_frame(a_pathways.to_csv, f"{incytr_input.group_a}.csv"),
-            dcc.send_data_frame(b_pathways.to_csv, f"{incytr_input.group_b}.csv"),
-        )
+    pf = pathways_filter_from_inputs(incytr_input, pcf, sliders_container_children)
+
+    return {
+        "url": get_relative_path("/download"),
+        "body": {
+            "filter": pf.filter_state(),
+            "format": fmt or "csv",
+            "dataset": dataset,
+        },
+        "n_clicks": n_clicks,
+    }
+
+
+clientside_callback(
+    """
+    function(data) {
+        if (!data) {
+            return window.dash_clientside.no_update;
+        }
+        const form = document.createElement("form");
+        form.method = "POST";
+        form.action = data.url;
+        form.style.display = "none";
+        const input = document.createElement("input");
+        input.type = "hidden";
+        input.name = "request";
+        input.value = JSON.stringify(data.body);
+        form.appendChild(input);
+        document.body.appendChild(form);
+        form.submit();
+        form.remove();
+        return data.n_clicks;
+    }
+    """,
+    Output("download-submitted", "children"),
+    Input("download-request", "data"),
+    prevent_initial_call=True,
+)
 
 
 @callback(
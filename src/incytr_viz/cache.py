@@ -0,0 +1,176 @@
+import hashlib
+import json
+import os
+import threading
+
+import numpy as np
+
+from incytr_viz.column_store import read_column_store, write_column_store
+
+# bump whenever the layout of the cached IncytrInput state changes
+CACHE_VERSION = 5
+
+CACHE_SUFFIX = ".incytr_cache"
+
+_HASH_CHUNK_BYTES = 1 << 20
+
+
+def _tmp_name(fpath):
+    # unique per writer, so concurrent writers do not clobber each other's files
+    return f"{fpath}.{os.getpid()}.{threading.get_ident()}.tmp"
+
+
+def cache_dir_for(pathways_path):
+    """Sidecar cache directory stored next to the pathways file"""
+    return os.path.abspath(pathways_path) + CACHE_SUFFIX
+
+
+def file_stat(fpath):
+    st = os.stat(fpath)
+    return {
+        "path": os.path.abspath(fpath),
+        "size": st.st_size,
+        "mtime_ns": st.st_mtime_ns,
+    }
+
+
+def file_digest(fpath):
+    h = hashlib.blake2b(digest_size=16)
+    with open(fpath, "rb") as f:
+        for chunk in iter(lambda: f.read(_HASH_CHUNK_BYTES), b""):
+            h.update(chunk)
+    return h.hexdigest()
+
+
+def input_fingerprint(input_paths, options=None, with_digest=True):
+    """
+    Fingerprint for a set of input files
+
+    input_paths: dict of {name: filepath}
+    options: any loader options that change the cached result (must be json serializable)
+    with_digest: include a content hash of each file. Hashing reads every byte, so callers
+        compare the cheap stat-only fingerprint first
+    """
+    files = {}
+    for name, fpath in input_paths.items():
+        files[name] = file_stat(fpath)
+        if with_digest:
+            files[name]["digest"] = file_digest(fpath)
+
+    return {
+        "version": CACHE_VERSION,
+        "options": options or {},
+        "files": files,
+    }
+
+
+def _strip_digests(fingerprint):
+    return {
+        **fingerprint,
+        "files": {
+            name: {k: v for k, v in f.items() if k != "digest"}
+            for name, f in fingerprint["files"].items()
+        },
+    }
+
+
+def read_cache(cache_dir, input_paths, options=None):
+    """
+    Return the cached state dict if the cache matches the input files, else None
+
+    Size and mtime are checked before the (slow) content hash so a stale cache is
+    rejected without reading the inputs. Frames written with write_cache(frames=...)
+    are included in the state, memory-mapped from their column stores, and so are the
+    arrays. Nothing is unpickled, so files placed in the cache cannot run code.
+    """
+    fingerprint_file = os.path.join(cache_dir, "fingerprint.json")
+    state_file = os.path.join(cache_dir, "state.json")
+    arrays_file = os.path.join(cache_dir, "arrays.npz")
+
+    if not (os.path.exists(fingerprint_file) and os.path.exists(state_file)):
+        return None
+
+    with open(fingerprint_file, "rt") as f:
+        cached_fingerprint = json.load(f)
+
+    current = input_fingerprint(input_paths, options, with_digest=False)
+    if _strip_digests(cached_fingerprint) != current:
+        return None
+
+    if input_fingerprint(input_paths, options) != cached_fingerprint:
+        return None
+
+    with open(state_file, "rt") as f:
+        payload = json.load(f)
+
+    state = payload["state"]
+    for name in payload["frames"]:
+        state[name] = read_column_store(os.path.join(cache_dir, name))
+    if payload["arrays"]:
+        with np.load(arrays_file, allow_pickle=False) as arrays:
+            for name in payload["arrays"]:
+                state[name] = arrays[name]
+    return state
+
+
+def write_cache(
+    cache_dir,
+    input_paths,
+    state,
+    options=None,
+    frames=None,
+    arrays=None,
+    fingerprint=None,
+):
+    """
+    Write state and the fingerprint of the input files to cache_dir
+
+    state: json serializable dict
+    frames: dict of {name: DataFrame} stored as column stores (see column_store), so
+        readers can share them memory-mapped
+    arrays: dict of {name: numeric ndarray} stored in one npz file
+    fingerprint: input_fingerprint taken before the input files were read, so files
+        rewritten while loading do not match the cache; taken now if None
+
+    Files are written to temporary names and moved into place so a reader never sees
+    a partially written cache, including while a reload rewrites it. Returns the
+    frames re-opened from the cache.
+    """
+    frames = frames or {}
+    arrays = arrays or {}
+    os.makedirs(cache_dir, exist_ok=True)
+
+    if fingerprint is None:
+        fingerprint = input_fingerprint(input_paths, options)
+
+    fingerprint_file = os.path.join(cache_dir, "fingerprint.json")
+    state_file = os.path.join(cache_dir, "state.json")
+    arrays_file = os.path.join(cache_dir, "arrays.npz")
+
+    # drop the old fingerprint first so a crash mid-write leaves no valid-looking
+    # cache, and the pickle written by older versions
+    for fpath in [fingerprint_file, os.path.join(cache_dir, "data.pkl")]:
+        try:
+            os.remove(fpath)
+        except FileNotFoundError:
+            pass
+
+    for name, df in frames.items():
+        write_column_store(os.path.join(cache_dir, name), df)
+
+    arrays_tmp = _tmp_name(arrays_file)
+    with open(arrays_tmp, "wb") as f:
+        np.savez(f, **arrays)
+    os.replace(arrays_tmp, arrays_file)
+
+    state_tmp = _tmp_name(state_file)
+    with open(state_tmp, "wt") as f:
+        json.dump({"state": state, "frames": list(frames), "arrays": list(arrays)}, f)
+    os.replace(state_tmp, state_file)
+
+    fingerprint_tmp = _tmp_name(fingerprint_file)
+    with open(fingerprint_tmp, "wt") as f:
+        json.dump(fingerprint, f)
+    os.replace(fingerprint_tmp, fingerprint_file)
+
+    return {name: read_column_store(os.path.join(cache_dir, name)) for name in frames}
@@ -0,0 +1,121 @@
+"""
+On-disk column store for a DataFrame, read back memory-mapped
+
+Every column is one .npy file: numeric columns hold their values, categorical and
+string columns hold integer codes into a dictionary file (json). Readers map the .npy
+files read-only, so every process reading the same store shares its pages through the
+OS page cache instead of holding a private copy.
+
+pandas cannot back a string column with a shared buffer, so string columns are
+dictionary encoded on disk but materialized by each reader.
+"""
+
+import json
+import os
+import shutil
+import tempfile
+
+import numpy as np
+import pandas as pd
+
+COLUMNS_FILE = "columns.json"
+
+
+def _smallest_code_dtype(num_categories):
+    for dtype in [np.int8, np.int16, np.int32]:
+        if num_categories < np.iinfo(dtype).max:
+            return dtype
+    return np.int64
+
+
+def write_column_store(directory, df: pd.DataFrame):
+    """
+    Write df to directory, replacing any existing store
+
+    df must have a default RangeIndex. The store is written to a temporary directory
+    of its own and moved into place, so readers never see a partial store and
+    concurrent writers do not write into each other's files.
+    """
+    if not df.index.equals(pd.RangeIndex(len(df))):
+        raise ValueError("column store requires a default RangeIndex")
+
+    directory = os.path.abspath(directory)
+    tmp = tempfile.mkdtemp(
+        prefix=os.path.basename(directory) + ".",
+        suffix=".tmp",
+        dir=os.path.dirname(directory),
+    )
+
+    columns = []
+    for i, name in enumerate(df.columns):
+        col = df[name]
+        entry = {"name": name, "dtype": str(col.dtype), "file": f"{i}.npy"}
+        categories = None
+
+        if isinstance(col.dtype, pd.CategoricalDtype):
+            entry["kind"] = "categorical"
+            entry["ordered"] = bool(col.cat.ordered)
+            entry["categories_dtype"] = str(col.cat.categories.dtype)
+            values = col.array.codes
+            categories = col.cat.categories
+        elif isinstance(col.dtype, np.dtype) and col.dtype.kind in "biuf":
+            entry["kind"] = "numeric"
+            values = col.to_numpy()
+        else:
+            entry["kind"] = "string"
+            values, categories = pd.factorize(col)
+            values = values.astype(_smallest_code_dtype(len(categories)))
+
+        np.save(os.path.join(tmp, entry["file"]), values, allow_pickle=False)
+
+        if categories is not None:
+            entry["categories_file"] = f"{i}.categories.json"
+            with open(os.path.join(tmp, entry["categories_file"]), "wt") as f:
+                json.dump(categories.tolist(), f)
+
+        columns.append(entry)
+
+    with open(os.path.join(tmp, COLUMNS_FILE), "wt") as f:
+        json.dump({"num_rows": len(df), "columns": columns}, f)
+
+    shutil.rmtree(directory, ignore_errors=True)
+    try:
+        os.replace(tmp, directory)
+    except OSError:
+        # another writer moved its store into place first
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+
+def read_column_store(directory) -> pd.DataFrame:
+    """DataFrame backed by read-only memory maps of the store's numeric and code files"""
+    with open(os.path.join(directory, COLUMNS_FILE), "rt") as f:
+        meta = json.load(f)
+
+    data = {}
+    for entry in meta["columns"]:
+        values = np.load(os.path.join(directory, entry["file"]), mmap_mode="r")
+        # a plain ndarray view of the map; pandas keeps it without copying
+        values = np.asarray(values)
+
+        if entry["kind"] == "numeric":
+            data[entry["name"]] = values
+            continue
+
+        with open(os.path.join(directory, entry["categories_file"]), "rt") as f:
+            categories = json.load(f)
+
+        if entry["kind"] == "categorical":
+            dtype = pd.CategoricalDtype(
+                pd.Index(categories, dtype=entry["categories_dtype"]),
+                ordered=entry["ordered"],
+            )
+            data[entry["name"]] = pd.Categorical.from_codes(
+                values, dtype=dtype, validate=False
+            )
+        else:
+            # code -1 (missing) picks the trailing None
+            lookup = np.array(categories + [None], dtype=object)
+            data[entry["name"]] = pd.array(lookup[values], dtype=entry["dtype"])
+
+    return pd.DataFrame(data, index=pd.RangeIndex(meta["num_rows"]), copy=False)
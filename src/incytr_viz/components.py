@@ -4,7 +4,7 @@ import numpy as np
 import pandas as pd
 import plotly.express as px
 import plotly.graph_objects as go
-from dash import dcc, html
+from dash import Patch, dcc, html
 from plotly.subplots import make_subplots
 
 from incytr_viz.util import *
@@ -42,88 +42,93 @@ def cytoscape_stylesheet(show_network_weights):
     ]
 
 
-def create_hist_figure(paths, has_tpds, has_ppds, has_p_value):
+def histogram_columns(has_tpds, has_ppds, has_p_value) -> list[str]:
+    """Columns shown in the histogram figure, in trace order"""
+    columns = ["sigprob"]
+    if has_tpds:
+        columns.append("tpds")
+    if has_ppds:
+        columns.append("ppds")
+    if has_p_value:
+        columns.append("p_value")
+    return columns
 
-    plot_order = [(1, 1), (1, 2), (2, 1), (2, 2)]
-    curr_idx = 0
 
-    common_hist_params = dict(
-        nbinsx=100,
-    )
+def create_hist_figure(histogram_edges: dict):
+    """
+    Histogram figure with one empty bar trace per column
 
-    fig = make_subplots(2, 2)
+    histogram_edges: {column: bin edges}, in trace order (see histogram_columns)
 
-    fig.add_trace(
-        go.Histogram(x=paths["sigprob"], name="SigProb", **common_hist_params),
-        row=plot_order[curr_idx][0],
-        col=plot_order[curr_idx][1],
-    )
-    curr_idx += 1
+    The figure is built once per dataset and only the bar heights are sent on each
+    update (hist_counts_patch)
+    """
 
-    if has_tpds:
-        fig.add_trace(
-            go.Histogram(
-                x=paths["tpds"],
-                name="TPDS",
-                **common_hist_params,
-            ),
-            row=plot_order[curr_idx][0],
-            col=plot_order[curr_idx][1],
-        )
-        curr_idx += 1
-    if has_ppds:
-        fig.add_trace(
-            go.Histogram(
-                x=paths["ppds"],
-                name="PPDS",
-                **common_hist_params,
-            ),
-            row=plot_order[curr_idx][0],
-            col=plot_order[curr_idx][1],
-        )
-        curr_idx += 1
+    names = {
+        "sigprob": "SigProb",
+        "tpds": "TPDS",
+        "ppds": "PPDS",
+        "p_value": "P-Value",
+    }
 
-    if has_p_value:
+    plot_order = [(1, 1), (1, 2), (2, 1), (2, 2)]
+
+    fig = make_subplots(2, 2)
+
+    for curr_idx, (column, edges) in enumerate(histogram_edges.items()):
         fig.add_trace(
-            go.Histogram(x=paths["p_value"], name="P-Value", **common_hist_params),
+            go.Bar(
+                x=(edges[:-1] + edges[1:]) / 2,
+                y=np.zeros(len(edges) - 1, dtype=int),
+                width=np.diff(edges),
+                name=names[column],
+            ),
             row=plot_order[curr_idx][0],
             col=plot_order[curr_idx][1],
         )
-        curr_idx += 1
 
     # Update layout for subplots
     fig.update_xaxes(title_text="Value")
     fig.update_yaxes(title_text="Count")
 
-    # Create subplots grid
     fig.update_layout(
-        # xaxis=dict(domain=[0, 0.5]),  # Adjust x-axis domain for the first two subplots
-        # xaxis2=dict(
-        #     domain=[0.5, 1]
-        # ),  # Adjust x-axis domain for the second two subplots
-        # yaxis=dict(domain=[0, 0.5]),  # Adjust y-axis domain for the first two subplots
-        # yaxis2=dict(
-        #     domain=[0.5, 1]
-        # ),  # Adjust y-axis domain for the second two subplots
+        bargap=0,
         showlegend=True,
     )
 
     return fig
 
 
-def umap_graph(group_id, has_umap, all_pathways):
+def hist_counts_patch(columns: list[str], counts: dict) -> Patch:
+    """Update the bar heights of a figure from create_hist_figure"""
+    patch = Patch()
+    for curr_idx, column in enumerate(columns):
+        patch["data"][curr_idx]["y"] = counts[column].tolist()
+    return patch
+
+
+def umap_graph(group_id, has_umap, points):
+    """
+    WebGL scatter of the pathways umap
+
+    points: umap1, umap2, afc and path of the pathways to draw (see
+        PathwaysFilterEngine.umap_points and UmapLevelOfDetail)
+    """
 
     if not has_umap:
         return None
 
     fig = px.scatter(
-        all_pathways,
+        points,
         x="umap1",
         y="umap2",
         color="afc",
         custom_data=["path"],
         color_continuous_scale=px.colors.diverging.Spectral[::-1],
+        render_mode="webgl",
     )
+    # keep the user's zoom when the points are replaced (umap_points_patch)
+    fig.update_layout(uirevision="umap")
     scatter = dcc.Graph(
         id=f"umap-graph-{group_id}",
         figure=fig,
@@ -132,6 +137,16 @@ def umap_graph(group_id, has_umap, all_pathways):
     return scatter
 
 
+def umap_points_patch(points) -> Patch:
+    """Replace the points of a umap_graph figure (points as for umap_graph)"""
+    patch = Patch()
+    patch["data"][0]["x"] = points["umap1"].tolist()
+    patch["data"][0]["y"] = points["umap2"].tolist()
+    patch["data"][0]["marker"]["color"] = points["afc"].tolist()
+    patch["data"][0]["customdata"] = points[["path"]].to_numpy().tolist()
+    return patch
+
+
 def cytoscape_container(
     id,
     show_network_weights,
@@ -167,7 +182,9 @@ def sankey_container(
     color,
     group_id,
     color_flow,
+    folded=None,
 ):
+    """folded: number of nodes folded into the "Other" node of each layer, if any"""
 
     num_links = len(source)
     is_empty = num_links == 0
@@ -190,159 +207,156 @@ def sankey_container(
         "height": get_sankey_height(is_empty, no_targets, num_targets, num_effectors)
     }
 
-    warn_style = {"display": "none"} if not no_targets else {}
+    warn_style = {"display": "none"} if not folded else {}
 
     # Drop duplicate rows based on row index
     unique_clusters = clusters.loc[~clusters.index.duplicated(keep="first")]
 
-    if num_links > 2000:
-        return html.Div(
-            [
-                sankey_legend_container(),
-                html.Div(
-                    "Too many links to display. Please apply additional filters.",
-                    className="linksWarning",
-                ),
-            ],
-            className="sankeyTitleAndLegend",
-        )
-
-    else:
-
-        return html.Div(
-            [
-                html.Div(
-                    [
-                        sankey_legend_container(),
-                        html.Div(
-                            [
-                                html.H4("Cell type"),
-                                html.Div(
-                                    [
-                                        dbc.Table(
-                                            [
-                                                html.Tbody(
-                                                    [
-                                                        html.Tr(
-                                                            [
-                                                                html.Td(r[0]),
-                                                                html.Td(
-                                                                    [],
-                                                                    style={
-                                                                        "backgroundColor": r[
-                                                                            1
-                                                                        ][
-                                                                            "color"
-                                                                        ],
-                                                                        "width": "20px",
-                                                                    },
-                                                                ),
-                                                            ],
-                                                            className="sankeyLinkColorLegendRow",
-                                                        )
-                                                        for r in unique_clusters.iterrows()
-                                                    ]
-                                                )
-                                            ]
-                                        ),
-                                    ],
-                                ),
-                            ],
-                            className="sankeyLinkColorLegend",
-                            style=(
-                                {}
-                                if (color_flow in ["sender", "receiver"])
-                                else {"display": "none"}
-                            ),
-                        ),
-                        html.Div(
-                            [
-                                html.H4("Kinase-Substrate Relationship"),
-                                html.Div(
-                                    [
-                                        dbc.Table(
-                                            [
-                                                html.Tbody(
-                                                    [
-                                                        html.Tr(
-                                                            [
-                                                                html.Td(k),
-                                                                html.Td(
-                                                                    [],
-                                                                    style={
-                                                                        "backgroundColor": v,
-                                                                        "width": "20px",
-                                                                    },
-                                                                ),
-                                                            ],
-                                                            className="sankeyLinkColorLegendRow",
-                                                        )
-                                                        for k, v in kinase_color_map().items()
-                                                    ]
-                                                )
-                                            ]
-                                        ),
-                                    ],
-                                ),
-                            ],
-                            className="sankeyLinkColorLegend",
-                            style=(
-                                {} if (color_flow == "kinase") else {"display": "none"}
+    return html.Div(
+        [
+            html.Div(
+                [
+                    sankey_legend_container(),
+                    html.Div(
+                        [
+                            html.H4("Cell type"),
+                            html.Div(
+                                [
+                                    dbc.Table(
+                                        [
+                                            html.Tbody(
+                                                [
+                                                    html.Tr(
+                                                        [
+                                                            html.Td(r[0]),
+                                                            html.Td(
+                                                                [],
+                                                                style={
+                                                                    "backgroundColor": r[
+                                                                        1
+                                                                    ][
+                                                                        "color"
+                                                                    ],
+                                                                    "width": "20px",
+                                                                },
+                                                            ),
+                                                        ],
+                                                        className="sankeyLinkColorLegendRow",
+                                                    )
+                                                    for r in unique_clusters.iterrows()
+                                                ]
+                                            )
+                                        ]
+                                    ),
+                                ],
                             ),
+                        ],
+                        className="sankeyLinkColorLegend",
+                        style=(
+                            {}
+                            if (color_flow in ["sender", "receiver"])
+                            else {"display": "none"}
                         ),
-                    ],
-                    className="sankeyTitleAndLegend",
-                ),
-                dcc.Graph(
-                    figure=go.Figure(
-                        go.Sankey(
-                            arrangement="fixed",
-                            node=dict(
-                                pad=15,
-                                thickness=20,
-                                line=dict(color="black", width=0.5),
-                                label=labels,
-                                customdata=ids,
-                                hovertemplate="%{label}: %{value:.0f} pathways<extra></extra>",
-                                color=get_node_colors(ids),
-                            ),
-                            link=dict(
-                                source=source,
-                                target=target,
-                                value=value,
-                                color=color,
-                                customdata=color,
-                                hovertemplate="%{source.customdata} --> %{target.customdata}: %{value:.0f} pathways<extra></extra>",
+                    ),
+                    html.Div(
+                        [
+                            html.H4("Kinase-Substrate Relationship"),
+                            html.Div(
+                                [
+                                    dbc.Table(
+                                        [
+                                            html.Tbody(
+                                                [
+                                                    html.Tr(
+                                                        [
+                                                            html.Td(k),
+                                                            html.Td(
+                                                                [],
+                                                                style={
+                                                                    "backgroundColor": v,
+                                                                    "width": "20px",
+                                                                },
+                                                            ),
+                                                        ],
+                                                        className="sankeyLinkColorLegendRow",
+                                                    )
+                                                    for k, v in kinase_color_map().items()
+                                                ]
+                                            )
+                                        ]
+                                    ),
+                                ],
                             ),
-                        ),
+                        ],
+                        className="sankeyLinkColorLegend",
+                        style=({} if (color_flow == "kinase") else {"display": "none"}),
                     ),
-                    id=f"sankey-{group_id}",
-                    className="sankey",
-                    style=sankey_style,
-                ),
-                html.Div(
-                    [
-                        dbc.Button(
-                            "!",
-                            id=f"sankey-warning-{group_id}",
-                            color="white",
-                            style=warn_style,
-                            className="sankeyWarning",
+                ],
+                className="sankeyTitleAndLegend",
+            ),
+            dcc.Graph(
+                figure=go.Figure(
+                    go.Sankey(
+                        arrangement="fixed",
+                        node=dict(
+                            pad=15,
+                            thickness=20,
+                            line=dict(color="black", width=0.5),
+                            label=labels,
+                            customdata=ids,
+                            hovertemplate="%{label}: %{value:.0f} pathways<extra></extra>",
+                            color=get_node_colors(ids),
                         ),
-                        dbc.Popover(
-                            dbc.PopoverBody(
-                                "Too many target genes to display. To display targets, please apply additional filters"
-                            ),
-                            trigger="hover",
-                            body=True,
-                            target=f"sankey-warning-{group_id}",
+                        link=dict(
+                            source=source,
+                            target=target,
+                            value=value,
+                            color=color,
+                            customdata=color,
+                            hovertemplate="%{source.customdata} --> %{target.customdata}: %{value:.0f} pathways<extra></extra>",
                         ),
-                    ],
-                    className="sankeyWarningAndLegendContainer",
+                    ),
                 ),
-            ],
-            className="sankeyContainer",
-        )
+                id=f"sankey-{group_id}",
+                className="sankey",
+                style=sankey_style,
+            ),
+            html.Div(
+                [
+                    dbc.Button(
+                        "!",
+                        id=f"sankey-warning-{group_id}",
+                        color="white",
+                        style=warn_style,
+                        className="sankeyWarning",
+                    ),
+                    dbc.Popover(
+                        dbc.PopoverBody(sankey_folded_message(folded)),
+                        trigger="hover",
+                        body=True,
+                        target=f"sankey-warning-{group_id}",
+                    ),
+                ],
+                className="sankeyWarningAndLegendContainer",
+            ),
+        ],
+        className="sankeyContainer",
+    )
+
+
+def sankey_folded_message(folded) -> str:
+    names = {
+        "ligand": "ligands",
+        "receptor": "receptors",
+        "em": "EMs",
+        "target": "targets",
+    }
+    counts = ", ".join(f"{n} {names[layer]}" for layer, n in (folded or {}).items())
+    return (
+        f"Too many pathways to display individually: {counts} carrying the fewest "
+        f"pathways are grouped into {SANKEY_OTHER_LABEL} nodes. Apply additional "
+        "filters to display them."
+    )
 
 
 def _sankey_legend(label, color):
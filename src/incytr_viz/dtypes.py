@@ -73,3 +73,10 @@ clusters_dtypes = {
     "condition": str,
     "population": np.float64,  # fraction of total
 }
+
+# float columns are narrowed to this with IncytrInput(compact_dtypes=True)
+compact_float_dtype = np.float32
+
+# ...except those starting with one of these: p value cut-offs can be far below what
+# float32 resolves
+compact_full_precision_prefixes = ("p_value",)
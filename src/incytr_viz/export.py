@@ -0,0 +1,130 @@
+"""
+Streaming export of filtered pathways
+
+Both groups go into one zip archive, written a chunk of rows at a time and yielded as
+it is produced, so memory use depends on the chunk size rather than on the number of
+exported pathways.
+"""
+
+import io
+import zipfile
+
+try:
+    import pyarrow as pa
+    import pyarrow.parquet as pq
+except ImportError:  # parquet export is optional
+    pa = None
+    pq = None
+
+from incytr_viz.util import FilterResult, PathwaysFilterEngine
+
+# rows per chunk read from the pathways table and encoded at once
+EXPORT_CHUNK_ROWS = 50000
+
+
+def export_formats() -> list[str]:
+    """File formats available for export; parquet needs pyarrow"""
+    return ["csv", "parquet"] if pa is not None else ["csv"]
+
+
+class _StreamBuffer(io.RawIOBase):
+    """Write-only sink that holds bytes until they are drained into the response"""
+
+    def __init__(self):
+        self._chunks = []
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        self._chunks.append(bytes(b))
+        self._position += len(b)
+        return len(b)
+
+    def drain(self) -> bytes:
+        data = b"".join(self._chunks)
+        self._chunks.clear()
+        return data
+
+
+class _CountingWriter(io.RawIOBase):
+    """Adds the tell() pyarrow needs to a zip entry opened for writing"""
+
+    def __init__(self, raw):
+        self._raw = raw
+        self._position = 0
+
+    def writable(self):
+        return True
+
+    def write(self, b):
+        n = self._raw.write(b)
+        self._position += n
+        return n
+
+    def tell(self):
+        return self._position
+
+
+def _row_chunks(rows, chunk_rows):
+    # an empty selection still gets one (empty) chunk, so the file has a header
+    for start in range(0, max(len(rows), 1), chunk_rows):
+        yield rows[start : start + chunk_rows]
+
+
+def _write_csv(entry, chunks, empty):
+    header = True
+    for df in chunks:
+        entry.write(df.to_csv(header=header).encode("utf-8"))
+        header = False
+        yield
+
+
+def _write_parquet(entry, chunks, empty):
+    schema = pa.Schema.from_pandas(empty, preserve_index=True)
+    with pq.ParquetWriter(_CountingWriter(entry), schema) as writer:
+        for df in chunks:
+            writer.write_table(
+                pa.Table.from_pandas(df, schema=schema, preserve_index=True)
+            )
+            yield
+
+
+_WRITERS = {"csv": _write_csv, "parquet": _write_parquet}
+
+
+def stream_export_archive(
+    engine: PathwaysFilterEngine,
+    group_results: list[tuple[str, str, FilterResult]],
+    fmt="csv",
+    chunk_rows=EXPORT_CHUNK_ROWS,
+):
+    """
+    Yield a zip archive holding one file per group
+
+    group_results: (file name without extension, group id, FilterResult) per group
+    fmt: one of export_formats(); csv entries are deflate compressed, parquet files
+        are compressed internally and stored as they are
+    """
+    if fmt not in export_formats():
+        raise ValueError(f"Unsupported export format {fmt}")
+
+    sink = _StreamBuffer()
+    compression = zipfile.ZIP_DEFLATED if fmt == "csv" else zipfile.ZIP_STORED
+
+    with zipfile.ZipFile(sink, "w", compression=compression) as archive:
+        for name, group_id, result in group_results:
+            chunks = (
+                engine.group_frame(group_id, rows)
+                for rows in _row_chunks(result.rows, chunk_rows)
+            )
+            empty = engine.group_frame(group_id, result.rows[:0])
+
+            # sizes are unknown up front, so allow entries over 4 GB
+            with archive.open(f"{name}.{fmt}", "w", force_zip64=True) as entry:
+                for _ in _WRITERS[fmt](entry, chunks, empty):
+                    yield sink.drain()
+            yield sink.drain()
+
+    yield sink.drain()
@@ -0,0 +1,129 @@
+"""
+Parallel csv parsing by byte ranges
+
+The file is cut into ranges that start and end on line boundaries and each range is
+parsed (and optionally transformed) in its own process, so parse time scales with the
+number of cores. Ranges assume one record per line -- fields with quoted newlines are
+not supported, which holds for the machine-written pathways files.
+
+Off the main thread (a reload while serving, or a worker thread loading a catalogue
+dataset) the processes are started by a forkserver rather than forked from this
+process, which would copy the locks held by its other threads and the data it has
+loaded, and would make the processes children of a gunicorn master that reaps them.
+"""
+
+import io
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable
+
+import pandas as pd
+from tqdm import tqdm
+
+# smallest range worth handing to another process
+MIN_RANGE_BYTES = 8 * 2**20
+
+COMPRESSED_SUFFIXES = (".gz", ".bz2", ".zip", ".xz", ".zst", ".tar")
+
+
+def byte_ranges(fpath, num_ranges) -> list[tuple[int, int]]:
+    """
+    Split fpath after its header line into at most num_ranges (start, end) ranges, each
+    ending just after a newline so no line is cut in two
+    """
+    size = os.path.getsize(fpath)
+
+    with open(fpath, "rb") as f:
+        f.readline()
+        data_start = f.tell()
+
+        bounds = [data_start]
+        step = max((size - data_start) // max(num_ranges, 1), 1)
+        for i in range(1, num_ranges):
+            f.seek(max(data_start + i * step, bounds[-1]))
+            f.readline()
+            pos = f.tell()
+            if pos >= size:
+                break
+            if pos > bounds[-1]:
+                bounds.append(pos)
+        bounds.append(size)
+
+    return [(s, e) for s, e in zip(bounds[:-1], bounds[1:]) if e > s]
+
+
+def _pool_context(transform=None):
+    """multiprocessing context for the parsing processes, None for the default"""
+    if threading.current_thread() is threading.main_thread():
+        return None
+    if "forkserver" not in multiprocessing.get_all_start_methods():
+        # e.g. windows, whose default (spawn) does not fork
+        return None
+
+    context = multiprocessing.get_context("forkserver")
+    # imported once by the forkserver rather than by each process it starts
+    preload = ["pandas"]
+    if transform is not None:
+        preload.append(getattr(transform, "func", transform).__module__)
+    context.set_forkserver_preload(preload)
+    return context
+
+
+def _read_range(fpath, start, end, names, transform, read_options):
+    with open(fpath, "rb") as f:
+        f.seek(start)
+        data = f.read(end - start)
+
+    df = pd.read_csv(io.BytesIO(data), header=None, names=names, **read_options)
+    return transform(df) if transform else df
+
+
+def read_csv_parallel(
+    fpath,
+    workers=None,
+    transform: Callable = None,
+    min_range_bytes=None,
+    **read_options,
+) -> list:
+    """
+    Parse fpath in up to `workers` processes; returns one result per range, in file order
+
+    transform: applied to each parsed range in its worker process, so its work is
+        parallel too; must be picklable (a module level function or staticmethod)
+    read_options: passed to pd.read_csv (sep, dtype, usecols ...)
+
+    Files are cut into ranges of at least min_range_bytes (default MIN_RANGE_BYTES).
+    Compressed files, and files too small to split, are read in this process as a
+    single range.
+    """
+    workers = workers or os.cpu_count() or 1
+    min_range_bytes = min_range_bytes or MIN_RANGE_BYTES
+    size = os.path.getsize(fpath)
+    num_ranges = min(workers, max(size // min_range_bytes, 1))
+
+    if num_ranges <= 1 or str(fpath).endswith(COMPRESSED_SUFFIXES):
+        df = pd.read_csv(fpath, **read_options)
+        return [transform(df) if transform else df]
+
+    names = pd.read_csv(fpath, nrows=0, sep=read_options.get("sep", ",")).columns
+    ranges = byte_ranges(fpath, num_ranges)
+
+    with ProcessPoolExecutor(
+        max_workers=len(ranges), mp_context=_pool_context(transform)
+    ) as pool:
+        futures = [
+            pool.submit(
+                _read_range, fpath, start, end, list(names), transform, read_options
+            )
+            for start, end in ranges
+        ]
+        return [
+            f.result()
+            for f in tqdm(
+                futures,
+                desc="Loading data",
+                bar_format="{l_bar}{bar}| {n_fmt} ranges/{total_fmt} [{elapsed}]",
+            )
+        ]
@@ -0,0 +1,157 @@
+"""
+Catalogue of datasets served by one app
+
+A catalogue directory holds one subdirectory per dataset, named after the dataset and
+holding a clusters file and a pathways file (file names starting with "clusters" and
+"pathways", as in the demo). Datasets are loaded on first use and the least recently
+used are dropped once the loaded datasets exceed the memory budget, so memory follows
+the datasets being viewed rather than the size of the catalogue.
+"""
+
+import os
+import threading
+from collections import OrderedDict
+
+from incytr_viz.reload import ReloadableInput
+from incytr_viz.util import IncytrInput, create_logger
+
+logger = create_logger(__name__)
+
+# memory budget for loaded datasets
+DATASET_MEMORY_MB = 4096
+
+INPUT_PREFIXES = ("clusters", "pathways")
+
+
+def discover_datasets(catalogue_dir) -> dict[str, dict]:
+    """
+    {dataset name: {"clusters": filepath, "pathways": filepath}} for each subdirectory
+    of catalogue_dir holding exactly one clusters and one pathways file
+    """
+    datasets = {}
+    for entry in sorted(os.scandir(catalogue_dir), key=lambda e: e.name):
+        if not entry.is_dir() or entry.name.startswith("."):
+            continue
+
+        files = {prefix: [] for prefix in INPUT_PREFIXES}
+        for f in sorted(os.scandir(entry.path), key=lambda e: e.name):
+            for prefix in INPUT_PREFIXES:
+                # skips the pathways cache, which is a directory
+                if f.is_file() and f.name.startswith(prefix):
+                    files[prefix].append(f.path)
+
+        if all(len(paths) == 1 for paths in files.values()):
+            datasets[entry.name] = {k: paths[0] for k, paths in files.items()}
+        elif any(files.values()):
+            logger.warning(
+                f"Skipping dataset {entry.name}: expected one clusters and one "
+                f"pathways file, found {files}"
+            )
+
+    return datasets
+
+
+class DatasetRegistry:
+    """
+    Loaded datasets of a catalogue directory, least recently used evicted first
+
+    The catalogue is rescanned when listed, so datasets added while serving appear
+    without a restart. input_options are passed to each IncytrInput. The memory budget
+    is checked on every get, as loaded datasets grow with the indexes built for their
+    filters; the dataset in use is never evicted, even when it alone exceeds the budget.
+    """
+
+    def __init__(self, catalogue_dir, max_memory_mb=DATASET_MEMORY_MB, **input_options):
+        if not os.path.isdir(catalogue_dir):
+            raise ValueError(f"Dataset catalogue {catalogue_dir} is not a directory")
+
+        self.catalogue_dir = catalogue_dir
+        self.max_bytes = int(max_memory_mb * 2**20)
+        self.input_options = input_options
+        self.loads = 0
+        self.evictions = 0
+        self._datasets = discover_datasets(catalogue_dir)
+        self._loaded = OrderedDict()
+        self._load_locks = {}
+        self._lock = threading.Lock()
+
+    def names(self) -> list[str]:
+        datasets = discover_datasets(self.catalogue_dir)
+        with self._lock:
+            self._datasets = datasets
+        return list(datasets)
+
+    def default(self):
+        """The first dataset in the catalogue, shown when none is named"""
+        return next(iter(self.names()), None)
+
+    def __contains__(self, name):
+        return name in self._datasets or name in self.names()
+
+    def get(self, name) -> IncytrInput:
+        """The named dataset, loaded on first use"""
+        with self._lock:
+            if name in self._loaded:
+                self._loaded.move_to_end(name)
+                self._evict()
+                return self._loaded[name].current
+            load_lock = self._load_locks.setdefault(name, threading.Lock())
+
+        # one thread loads a dataset while others asking for it wait
+        with load_lock:
+            with self._lock:
+                if name in self._loaded:
+                    self._loaded.move_to_end(name)
+                    return self._loaded[name].current
+
+            if name not in self:
+                raise KeyError(f"No dataset named {name} in {self.catalogue_dir}")
+
+            files = self._datasets[name]
+            logger.info(f"Loading dataset {name}")
+            dataset = ReloadableInput(
+                files["clusters"], files["pathways"], **self.input_options
+            )
+
+            with self._lock:
+                self._loaded[name] = dataset
+                self.loads += 1
+                self._evict()
+            return dataset.current
+
+    def reload(self, force=False) -> list:
+        """
+        Rebuild the loaded datasets whose input files changed (all of them with force)
+        in the background; see ReloadableInput.reload
+        """
+        with self._lock:
+            datasets = list(self._loaded.values())
+        threads = [d.reload(force=force) for d in datasets]
+        return [t for t in threads if t is not None]
+
+    def _evict(self):
+        if len(self._loaded) < 2:
+            return
+
+        sizes = {name: d.current.memory_usage() for name, d in self._loaded.items()}
+        nbytes = sum(sizes.values())
+
+        while nbytes > self.max_bytes and len(self._loaded) > 1:
+            name, _ = self._loaded.popitem(last=False)
+            nbytes -= sizes[name]
+            self.evictions += 1
+            logger.info(f"Evicted dataset {name} ({sizes[name] / 2**20:.0f} MB)")
+
+    def stats(self):
+        with self._lock:
+            loaded = {
+                name: d.current.memory_usage() for name, d in self._loaded.items()
+            }
+        return {
+            "datasets": len(self._datasets),
+            "loaded": list(loaded),
+            "nbytes": sum(loaded.values()),
+            "max_bytes": self.max_bytes,
+            "loads": self.loads,
+            "evictions": self.evictions,
+        }
@@ -0,0 +1,140 @@
+"""
+Reloading input files while serving
+
+A ReloadableInput rebuilds its IncytrInput in a background thread and swaps the new one
+in with a single assignment once it is complete: requests already holding the previous
+IncytrInput finish against it, later requests get the new one. An InputWatcher polls
+the input files and starts a reload once a change has settled.
+"""
+
+import os
+import threading
+from typing import Callable, Optional
+
+from incytr_viz.util import IncytrInput, create_logger
+
+logger = create_logger(__name__)
+
+
+def input_stats(input_paths: dict) -> dict:
+    """{name: (size, mtime_ns)} of each input file; None for a file that is missing"""
+    stats = {}
+    for name, fpath in input_paths.items():
+        try:
+            st = os.stat(fpath)
+            stats[name] = (st.st_size, st.st_mtime_ns)
+        except FileNotFoundError:
+            stats[name] = None
+    return stats
+
+
+class ReloadableInput:
+    """
+    An IncytrInput that is rebuilt from its input files while the current one is served
+
+    on_swap: callables run with the new IncytrInput after each swap
+
+    A failed rebuild is logged and the current data kept; it is not retried until the
+    files change again.
+    """
+
+    def __init__(self, clusters_path, pathways_path, **input_options):
+        self.input_paths = {"clusters": clusters_path, "pathways": pathways_path}
+        self.input_options = input_options
+        self.on_swap: list[Callable] = []
+        self.reloads = 0
+
+        self._lock = threading.Lock()
+        self._thread = None
+        self._built_stats = self._seen_stats = input_stats(self.input_paths)
+
+        self.current = self._build()
+
+    def _build(self) -> IncytrInput:
+        return IncytrInput(
+            clusters_path=self.input_paths["clusters"],
+            pathways_path=self.input_paths["pathways"],
+            **self.input_options,
+        )
+
+    def changed(self) -> bool:
+        """
+        Whether the input files differ from those the current data was built from and
+        are unchanged since the previous call, so files still being written are skipped
+        """
+        stats = input_stats(self.input_paths)
+        settled = stats == self._seen_stats and None not in stats.values()
+        self._seen_stats = stats
+        return settled and stats != self._built_stats
+
+    @property
+    def reloading(self) -> bool:
+        return self._thread is not None and self._thread.is_alive()
+
+    def reload(self, force=False) -> Optional[threading.Thread]:
+        """
+        Rebuild in a background thread if the input files changed, or regardless with
+        force. Returns the thread, or None if there is nothing to rebuild or a rebuild
+        is already running.
+        """
+        with self._lock:
+            if self.reloading or not (self.changed() or force):
+                return None
+            self._thread = threading.Thread(
+                target=self._rebuild, name="incytr-reload", daemon=True
+            )
+            self._thread.start()
+            return self._thread
+
+    def _rebuild(self):
+        # taken before reading, so files changed during the rebuild are reloaded again
+        stats = input_stats(self.input_paths)
+        logger.info(f"Reloading {self.input_paths['pathways']}")
+
+        try:
+            incytr_input = self._build()
+        except Exception:
+            logger.exception(
+                f"Could not reload {self.input_paths['pathways']}; "
+                "serving the previous data"
+            )
+            self._built_stats = stats
+            return
+
+        self._built_stats = stats
+        self.current = incytr_input
+        self.reloads += 1
+        logger.info(f"Reloaded {self.input_paths['pathways']}")
+
+        for callback in self.on_swap:
+            callback(incytr_input)
+
+
+class InputWatcher:
+    """
+    Daemon thread calling source.reload() every poll_seconds
+
+    source: a ReloadableInput, or a DatasetRegistry to watch its loaded datasets
+    """
+
+    def __init__(self, source, poll_seconds):
+        self.source = source
+        self.poll_seconds = poll_seconds
+        self._stop = threading.Event()
+        self._thread = threading.Thread(
+            target=self._run, name="incytr-watch", daemon=True
+        )
+
+    def start(self):
+        self._thread.start()
+        return self
+
+    def stop(self):
+        self._stop.set()
+
+    def _run(self):
+        while not self._stop.wait(self.poll_seconds):
+            try:
+                self.source.reload()
+            except Exception:
+                logger.exception("Could not check the input files for changes")
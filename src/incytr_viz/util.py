@@ -1,18 +1,33 @@
+import hashlib
 import json
 import logging
 import re
+import threading
 import time
-from dataclasses import dataclass, field
+from collections import OrderedDict
+from dataclasses import dataclass, field, fields
+from functools import partial
 from importlib import resources as impresources
 from typing import Callable, Literal
 
 import matplotlib.pyplot as plt
 import numpy as np
 import pandas as pd
-from tqdm import tqdm
 
 from incytr_viz import assets
-from incytr_viz.dtypes import clusters_dtypes, pathways_dtypes
+from incytr_viz.cache import (
+    cache_dir_for,
+    input_fingerprint,
+    read_cache,
+    write_cache,
+)
+from incytr_viz.dtypes import (
+    clusters_dtypes,
+    compact_float_dtype,
+    compact_full_precision_prefixes,
+    pathways_dtypes,
+)
+from incytr_viz.ingest import read_csv_parallel
 
 default_slider_tooltip = {
     "placement": "left",
@@ -63,6 +78,96 @@ def parse_separator(fpath, input_type="input"):
     return sep
 
 
+# pathway components stored as categoricals sharing one dictionary per group of columns
+GENE_COLUMNS = ["ligand", "receptor", "em", "target"]
+CELL_TYPE_COLUMNS = ["sender", "receiver"]
+
+# columns that identify a pathway; rows repeating all of them are duplicates
+PATH_KEY_COLUMNS = GENE_COLUMNS + CELL_TYPE_COLUMNS
+
+# kinase relationship columns of the pathways file. Loaded pathways keep one uint8
+# bitmask instead (bit i set when KINASE_COLUMNS[i] names a kinase), with the names
+# in a KinaseNames side table
+KINASE_COLUMNS = [
+    "sik_r_of_em",
+    "sik_r_of_t",
+    "sik_em_of_t",
+    "sik_em_of_r",
+    "sik_t_of_r",
+    "sik_t_of_em",
+]
+KINASE_BITS_COLUMN = "sik_bits"
+
+# values of a kinase column meaning "no kinase"
+NO_KINASE_VALUES = ["", "0", "NA", "nan", "False"]
+
+# most umap points sent to the browser for one viewport
+UMAP_POINT_BUDGET = 50000
+
+# river view size limits: nodes per layer and links in total. Beyond them the nodes
+# carrying the fewest pathways are folded into one "Other" node per layer
+SANKEY_NODE_BUDGET = 400
+SANKEY_LINK_BUDGET = 2000
+
+SANKEY_OTHER_LABEL = "Other"
+
+
+def to_shared_categorical(df, columns):
+    """Convert columns of df to categoricals with one set of categories shared between them"""
+    categories = pd.Index([])
+    for col in columns:
+        categories = categories.union(pd.Index(df[col].dropna().unique()))
+
+    dtype = pd.CategoricalDtype(categories)
+
+    for col in columns:
+        df[col] = df[col].astype(dtype)
+
+    return df
+
+
+def to_compact_dtypes(
+    df, float_dtype=compact_float_dtype, keep=compact_full_precision_prefixes
+):
+    """
+    Narrow the numeric columns of df (see IncytrInput(compact_dtypes=True))
+
+    Float columns become float_dtype (float32 by default, see dtypes), rounding values
+    to about 7 significant digits. The filters compare against thresholds rounded the
+    same way (see PathwaysFilterEngine.range_predicates), so a value within rounding of
+    a threshold can fall on the other side of it than at full precision. Columns
+    starting with one of keep, and columns with values float_dtype cannot hold (a
+    nonzero value becoming 0 or a finite one inf), stay float64.
+
+    Integer columns become the smallest integer type holding their values, which is
+    exact. Boolean flags are already packed (KINASE_BITS_COLUMN).
+    """
+    for col in df.columns:
+        kind = df[col].dtype.kind
+        if kind in "iu" and df[col].dtype.itemsize > 1:
+            downcast = "unsigned" if kind == "u" else "integer"
+            df[col] = pd.to_numeric(df[col], downcast=downcast)
+            continue
+
+        if df[col].dtype != np.float64 or col.startswith(keep):
+            continue
+
+        wide = df[col].to_numpy()
+        narrow = wide.astype(float_dtype)
+
+        with np.errstate(invalid="ignore"):
+            underflow = (narrow == 0) & (wide != 0)
+        overflow = np.isinf(narrow) & np.isfinite(wide)
+
+        if underflow.any() or overflow.any():
+            logger.info(f"Keeping {col} as float64 -- out of range for {float_dtype}")
+            continue
+
+        df[col] = narrow
+
+    return df
+
+
 def kinase_color_map():
 
     return {
@@ -74,9 +179,349 @@ def kinase_color_map():
     }
 
 
+@dataclass
+class LoadFilter:
+    """
+    Pathways dropped while the pathways file is read, so they never reach
+    IncytrInput.paths. Unset options keep every row.
+
+    Cell types are matched lower-cased (as stored), genes as written.
+    """
+
+    # keep rows whose sigprob reaches min_sigprob in at least one group
+    min_sigprob: float = None
+    # keep rows whose p value is at most max_p_value in at least one group
+    max_p_value: float = None
+    # keep rows whose sender and receiver are both listed
+    cell_types: list[str] = None
+    # drop rows whose sender or receiver is listed
+    exclude_cell_types: list[str] = None
+    # keep rows with at least one listed gene, in any role
+    genes: list[str] = None
+    # drop rows with any listed gene
+    exclude_genes: list[str] = None
+
+    def options(self) -> dict:
+        """The options that are set, for the cache fingerprint"""
+        return {
+            f.name: getattr(self, f.name)
+            for f in fields(self)
+            if getattr(self, f.name) is not None
+        }
+
+    def keep_mask(self, paths, groups) -> np.ndarray:
+        """Rows of split pathways (see IncytrInput.split_paths) to keep"""
+        keep = np.ones(len(paths), dtype=bool)
+
+        if self.min_sigprob is not None:
+            sigprobs = paths[["sigprob_" + g for g in groups]].to_numpy()
+            keep &= (sigprobs >= self.min_sigprob).any(axis=1)
+
+        p_value_cols = ["p_value_" + g for g in groups]
+        if self.max_p_value is not None and all(c in paths for c in p_value_cols):
+            keep &= (paths[p_value_cols].to_numpy() <= self.max_p_value).any(axis=1)
+
+        if self.cell_types is not None:
+            cell_types = [c.strip().lower() for c in self.cell_types]
+            for col in CELL_TYPE_COLUMNS:
+                keep &= paths[col].isin(cell_types).to_numpy()
+
+        if self.exclude_cell_types is not None:
+            cell_types = [c.strip().lower() for c in self.exclude_cell_types]
+            for col in CELL_TYPE_COLUMNS:
+                keep &= ~paths[col].isin(cell_types).to_numpy()
+
+        if self.genes is not None:
+            keep &= paths[GENE_COLUMNS].isin(self.genes).any(axis=1).to_numpy()
+
+        if self.exclude_genes is not None:
+            keep &= ~paths[GENE_COLUMNS].isin(self.exclude_genes).any(axis=1).to_numpy()
+
+        return keep
+
+
+class KinaseNames:
+    """
+    Kinase names of the pathways that have a kinase relationship, per kinase column
+
+    The pathways frame only records which relationships a row has (KINASE_BITS_COLUMN);
+    names are looked up here for display and export. Each column keeps the sorted rows
+    with a kinase and the codes of their names.
+    """
+
+    def __init__(self, names: dict):
+        # {column: (rows, codes, categories)}
+        self.names = names
+
+    @staticmethod
+    def encode(paths) -> tuple[pd.DataFrame, "KinaseNames"]:
+        """
+        Replace the KINASE_COLUMNS of paths (with a default RangeIndex) by a bitmask
+        column at the position of the first one
+        """
+        bits = np.zeros(len(paths), dtype=np.uint8)
+        names = {}
+
+        for i, col in enumerate(KINASE_COLUMNS):
+            values = paths[col]
+            present = ~(values.isna() | values.isin(NO_KINASE_VALUES)).to_numpy()
+            bits |= present.astype(np.uint8) << i
+
+            codes, categories = pd.factorize(values[present])
+            rows = np.flatnonzero(present).astype(row_dtype(len(paths)))
+            names[col] = (rows, codes, np.asarray(categories, dtype=object))
+
+        position = paths.columns.get_loc(KINASE_COLUMNS[0])
+        paths = paths.drop(columns=KINASE_COLUMNS)
+        paths.insert(position, KINASE_BITS_COLUMN, bits)
+
+        return paths, KinaseNames(names)
+
+    def lookup(self, column, positions) -> np.ndarray:
+        """Kinase name of each row position in column, "" where there is none"""
+        out = np.full(len(positions), "", dtype=object)
+        if column not in self.names or len(self.names[column][0]) == 0:
+            return out
+
+        rows, codes, categories = self.names[column]
+        i = np.minimum(np.searchsorted(rows, positions), len(rows) - 1)
+        hit = rows[i] == positions
+        out[hit] = categories[codes[i[hit]]]
+        return out
+
+
+def kinase_bit(column) -> int:
+    return 1 << KINASE_COLUMNS.index(column)
+
+
 class IncytrInput:
 
-    def __init__(self, clusters_path, pathways_path):
+    # attributes restored from / written to the on-disk cache (see incytr_viz.cache)
+    CACHED_ATTRIBUTES = [
+        "clusters",
+        "groups",
+        "raw_headers",
+        "formatted_headers",
+        "pos",
+        "neg",
+        "group_a",
+        "group_b",
+        "paths",
+        "kinase_names",
+        "has_tpds",
+        "has_ppds",
+        "has_p_value",
+        "has_kinase",
+        "has_umap",
+    ]
+
+    def __init__(
+        self,
+        clusters_path,
+        pathways_path,
+        use_cache=False,
+        filter_cache_mb=256,
+        umap_point_budget=UMAP_POINT_BUDGET,
+        sankey_node_budget=SANKEY_NODE_BUDGET,
+        sankey_link_budget=SANKEY_LINK_BUDGET,
+        load_workers=None,
+        load_filter: LoadFilter = None,
+        compact_dtypes=False,
+    ):
+
+        input_paths = {"clusters": clusters_path, "pathways": pathways_path}
+        cache_dir = cache_dir_for(pathways_path)
+
+        load_filter = load_filter or LoadFilter()
+        cache_options = {
+            "load_filter": load_filter.options(),
+            "compact_dtypes": compact_dtypes,
+        }
+
+        cached = None
+        if use_cache:
+            try:
+                cached = read_cache(cache_dir, input_paths, cache_options)
+            except Exception as e:
+                logger.warning(f"Could not read pathways cache at {cache_dir}: {e}")
+
+        if cached is not None:
+            logger.info(f"Loading pathways from cache at {cache_dir}")
+            self.restore_cache_state(cached)
+        else:
+            # taken before reading, so a file rewritten while loading is not cached
+            # under the new contents' fingerprint
+            fingerprint = (
+                input_fingerprint(input_paths, cache_options) if use_cache else None
+            )
+
+            self.load(
+                clusters_path,
+                pathways_path,
+                load_workers=load_workers,
+                load_filter=load_filter,
+                compact_dtypes=compact_dtypes,
+            )
+
+            if use_cache:
+                try:
+                    # frames go to column stores; switching to the memory-mapped copy
+                    # lets every worker process share one copy of the data
+                    state, frames, arrays = self.cache_state()
+                    frames = write_cache(
+                        cache_dir,
+                        input_paths,
+                        state,
+                        options=cache_options,
+                        frames=frames,
+                        arrays=arrays,
+                        fingerprint=fingerprint,
+                    )
+                    self.paths = frames["paths"]
+                    logger.info(f"Wrote pathways cache to {cache_dir}")
+                except Exception as e:
+                    logger.warning(
+                        f"Could not write pathways cache to {cache_dir}: {e}"
+                    )
+
+        self.unique_senders = self.paths["sender"].unique()
+        self.unique_receivers = self.paths["receiver"].unique()
+        self.unique_ligands = self.paths["ligand"].unique()
+        self.unique_receptors = self.paths["receptor"].unique()
+        self.unique_em = self.paths["em"].unique()
+        self.unique_targets = self.paths["target"].unique()
+
+        self.filter_engine = PathwaysFilterEngine(
+            self.paths,
+            self.group_a,
+            self.group_b,
+            result_cache=FilterResultCache(max_bytes=int(filter_cache_mb * 2**20)),
+            kinase_names=self.kinase_names,
+        )
+
+        self.umap_point_budget = umap_point_budget
+        self.sankey_node_budget = sankey_node_budget
+        self.sankey_link_budget = sankey_link_budget
+        self._umap_lods = {}
+
+        logger.info("Pathways loaded.")
+
+    def umap_level_of_detail(self, group_id, restrict_afc=False) -> "UmapLevelOfDetail":
+        """
+        Umap points of one group, built on first use
+
+        Every pathway is shown unless restrict_afc, which keeps those changed in the
+        group's direction (afc > 0 for group a, afc < 0 for group b) as the afc
+        direction filter does. The unrestricted points are shared by both groups.
+        """
+        key = group_id if restrict_afc else None
+        if key not in self._umap_lods:
+            self._umap_lods[key] = UmapLevelOfDetail(
+                self.paths["umap1"].to_numpy(),
+                self.paths["umap2"].to_numpy(),
+                rows=(
+                    np.flatnonzero(self.filter_engine.afc_masks[group_id])
+                    if restrict_afc
+                    else None
+                ),
+                budget=self.umap_point_budget,
+            )
+        return self._umap_lods[key]
+
+    def warm(self):
+        """
+        Build everything otherwise built on first use (filter indexes and umap points),
+        so processes forked afterwards share it; the filter result cache stays empty
+        """
+        self.filter_engine.warm()
+        if self.has_umap:
+            for group_id in ["a", "b"]:
+                for restrict_afc in [False, True]:
+                    self.umap_level_of_detail(group_id, restrict_afc)
+
+    def cache_state(self) -> tuple[dict, dict, dict]:
+        """
+        The CACHED_ATTRIBUTES as (json serializable state, frames, arrays), see
+        write_cache; nothing is pickled, so a cache cannot carry code
+        """
+        state = {
+            attr: getattr(self, attr) for attr in ["pos", "neg", "group_a", "group_b"]
+        }
+        state.update(
+            {
+                attr: bool(getattr(self, attr))
+                for attr in [
+                    "has_tpds",
+                    "has_ppds",
+                    "has_p_value",
+                    "has_kinase",
+                    "has_umap",
+                ]
+            }
+        )
+        state["groups"] = list(self.groups)
+        state["raw_headers"] = list(self.raw_headers)
+        state["formatted_headers"] = list(self.formatted_headers)
+        state["clusters_index"] = self.clusters.index.name
+        state["kinase_categories"] = {}
+
+        frames = {"paths": self.paths, "clusters": self.clusters.reset_index()}
+
+        arrays = {}
+        for col, (rows, codes, categories) in self.kinase_names.names.items():
+            state["kinase_categories"][col] = categories.tolist()
+            arrays[f"{col}.rows"] = rows
+            arrays[f"{col}.codes"] = codes
+
+        return state, frames, arrays
+
+    def restore_cache_state(self, cached):
+        """Set the CACHED_ATTRIBUTES from a read_cache result, see cache_state"""
+        for attr in [
+            "pos",
+            "neg",
+            "group_a",
+            "group_b",
+            "has_tpds",
+            "has_ppds",
+            "has_p_value",
+            "has_kinase",
+            "has_umap",
+            "paths",
+        ]:
+            setattr(self, attr, cached[attr])
+
+        self.groups = pd.array(cached["groups"])
+        self.raw_headers = pd.Index(cached["raw_headers"])
+        self.formatted_headers = pd.Index(cached["formatted_headers"])
+        self.clusters = cached["clusters"].set_index(cached["clusters_index"])
+        self.kinase_names = KinaseNames(
+            {
+                col: (
+                    cached[f"{col}.rows"],
+                    cached[f"{col}.codes"],
+                    np.asarray(categories, dtype=object),
+                )
+                for col, categories in cached["kinase_categories"].items()
+            }
+        )
+
+    def memory_usage(self) -> int:
+        """Approximate bytes held by this dataset, including indexes built since loading"""
+        nbytes = self.paths.memory_usage(deep=True).sum()
+        nbytes += self.clusters.memory_usage(deep=True).sum()
+        for lod in self._umap_lods.values():
+            nbytes += lod.priority_order.nbytes + lod.x.nbytes + lod.y.nbytes
+        return int(nbytes) + self.filter_engine.memory_usage()
+
+    def load(
+        self,
+        clusters_path,
+        pathways_path,
+        load_workers=None,
+        load_filter=None,
+        compact_dtypes=False,
+    ):
 
         try:
             self.clusters, self.groups = IncytrInput.get_clusters(clusters_path)
@@ -107,26 +552,31 @@ class IncytrInput:
 
             logger.info("Loading pathways............")
 
-            self.paths = pd.concat(
-                [
-                    chunk
-                    for chunk in tqdm(
-                        pd.read_csv(
-                            pathways_path,
-                            dtype=self.map_dtypes(),
-                            usecols=columns_to_keep,
-                            sep=pathways_sep,
-                            chunksize=1000,
-                        ),
-                        desc="Loading data",
-                        bar_format="{l_bar}{bar}| {n_fmt} chunks/{total_fmt} [{elapsed}]",
-                    )
-                ]
+            # each range is parsed, split into gene columns and load filtered in its
+            # own process
+            parts = read_csv_parallel(
+                pathways_path,
+                workers=load_workers,
+                transform=partial(
+                    IncytrInput.split_paths,
+                    groups=[self.group_a, self.group_b],
+                    load_filter=load_filter,
+                ),
+                dtype=self.map_dtypes(),
+                usecols=columns_to_keep,
+                sep=pathways_sep,
             )
+            self.paths = pd.concat([p for p, _ in parts], ignore_index=True)
+            malformed = pd.concat([m for _, m in parts], ignore_index=True)
         except Exception as e:
             raise ValueError(f"Error loading pathways file: {e}")
 
-        self.paths.columns = IncytrInput.format_headers(self.paths.columns)
+        if load_filter is not None and load_filter.options():
+            logger.info(f"{len(self.paths)} pathways kept by load filter")
+            if self.paths.empty:
+                raise ValueError(
+                    f"No pathways left after applying load filter {load_filter.options()}"
+                )
 
         self.has_tpds = "tpds" in self.paths.columns
         self.has_ppds = "ppds" in self.paths.columns
@@ -136,29 +586,18 @@ class IncytrInput:
             for x in ["p_value_" + self.group_a, "p_value_" + self.group_b]
         )
 
-        self.has_kinase = all(
-            x in self.paths.columns
-            for x in [
-                "sik_r_of_em",
-                "sik_r_of_t",
-                "sik_em_of_t",
-                "sik_em_of_r",
-                "sik_t_of_r",
-                "sik_t_of_em",
-            ]
-        )
+        self.has_kinase = all(x in self.paths.columns for x in KINASE_COLUMNS)
         self.has_umap = all(x in self.paths.columns for x in ["umap1", "umap2"])
 
-        self.paths = self.filter_pathways(self.paths)
+        if load_filter is not None and load_filter.max_p_value is not None:
+            if not self.has_p_value:
+                logger.warning("No p value columns found -- ignoring max p value")
 
-        self.unique_senders = self.paths["sender"].unique()
-        self.unique_receivers = self.paths["receiver"].unique()
-        self.unique_ligands = self.paths["ligand"].unique()
-        self.unique_receptors = self.paths["receptor"].unique()
-        self.unique_em = self.paths["em"].unique()
-        self.unique_targets = self.paths["target"].unique()
+        self.paths = self.filter_pathways(self.paths, malformed=malformed)
 
-        logger.info("Pathways loaded.")
+        if compact_dtypes:
+            # scores and umap coordinates in half the memory
+            self.paths = to_compact_dtypes(self.paths)
 
     @staticmethod
     def get_clusters(fpath):
@@ -298,12 +737,7 @@ class IncytrInput:
             "p_value_" + self.group_b,
             "tpds",
             "ppds",
-            "sik_r_of_em",
-            "sik_r_of_t",
-            "sik_em_of_t",
-            "sik_em_of_r",
-            "sik_t_of_r",
-            "sik_t_of_em",
+            *KINASE_COLUMNS,
             "umap1",
             "umap2",
         ]
@@ -349,38 +783,68 @@ class IncytrInput:
             if x[1] in columns_df[columns_df["found"]]["colname"].values
         ]
 
-    def filter_pathways(self, paths):
+    @staticmethod
+    def split_paths(
+        paths, groups=None, load_filter: LoadFilter = None
+    ) -> tuple[pd.DataFrame, pd.Series]:
+        """
+        Row-wise part of filter_pathways, safe to run on any slice of the file
+
+        Formats the headers, drops paths not of the form L*R*EM*T and splits the rest
+        into gene columns, which replace the path column, then drops the rows
+        load_filter excludes (groups: the two group names). Returns the split frame and
+        the malformed path strings.
+        """
+        paths.columns = IncytrInput.format_headers(paths.columns)
+
+        # paths repeat across sender/receiver pairs, so each distinct path is split
+        # once and rows pick up their genes by factorized code
+        codes, uniques = pd.factorize(paths["path"])
+        parts = [p.split("*") for p in uniques]
+
+        # code -1 (missing path) indexes the trailing False
+        is_complete = np.array([len(p) == 4 for p in parts] + [False])
+        complete = is_complete[codes]
+
+        malformed = paths.loc[~complete, "path"]
+        paths = paths.loc[complete]
+        codes = codes[complete]
+
+        for i, col in enumerate(GENE_COLUMNS):
+            genes = pd.array(
+                [p[i].strip() if len(p) == 4 else None for p in parts],
+                dtype=paths["path"].dtype,
+            )
+            paths[col] = genes.take(codes)
+
+        for col in CELL_TYPE_COLUMNS:
+            codes, uniques = pd.factorize(paths[col])
+            normalized = uniques.str.strip().str.lower().array
+            paths[col] = normalized.take(codes, allow_fill=True)
 
-        num_invalid = 0
+        if load_filter is not None:
+            paths = paths.loc[load_filter.keep_mask(paths, groups)]
 
-        incomplete_paths = paths["path"].str.strip().str.split("*").str.len() != 4
+        # the path is rebuilt from the gene and cell type columns when shown (see
+        # PathwaysFilterEngine.path_keys)
+        paths = paths.drop(columns="path")
 
-        if incomplete_paths.sum() > 0:
+        return paths, malformed
+
+    def filter_pathways(self, paths, malformed=None):
+        """
+        paths: pathways as read from the file, or already split by split_paths, in
+            which case malformed is the dropped paths it returned
+        """
+        if malformed is None:
+            paths, malformed = IncytrInput.split_paths(paths)
+
+        if len(malformed) > 0:
             logger.warning(
-                f"{incomplete_paths.sum()} rows with invalid pathway format found. Expecting form L*R*EM*T"
+                f"{len(malformed)} rows with invalid pathway format found. Expecting form L*R*EM*T"
             )
             logger.warning("First 10 invalid paths:")
-            logger.warning(paths[incomplete_paths]["path"].head().values)
-
-        num_invalid += len(incomplete_paths)
-
-        paths = paths.loc[~incomplete_paths]
-
-        paths["ligand"] = paths["path"].str.split("*").str[0].str.strip()
-        paths["receptor"] = paths["path"].str.split("*").str[1].str.strip()
-        paths["em"] = paths["path"].str.split("*").str[2].str.strip()
-        paths["target"] = paths["path"].str.split("*").str[3].str.strip()
-        paths["sender"] = paths["sender"].str.strip().str.lower()
-        paths["receiver"] = paths["receiver"].str.strip().str.lower()
-        paths["path"] = (
-            paths["path"]
-            .str.cat(paths["sender"], sep="*")
-            .str.cat(paths["receiver"], sep="*")
-        )
-
-        duplicates_mask = paths.duplicated()
-        if duplicates_mask.sum() > 0:
-            logger.warning(f"{duplicates_mask.sum()} duplicate rows found")
+            logger.warning(malformed.head().values)
 
         is_na_mask = (
             paths[["afc", "sigprob_" + self.group_a, "sigprob_" + self.group_b]]
@@ -392,27 +856,28 @@ class IncytrInput:
                 f"{is_na_mask.sum()} rows with invalid values found in required columns"
             )
 
-        invalid = duplicates_mask | is_na_mask
+        paths = paths[~is_na_mask]
 
-        if invalid.sum() > 0:
-            logger.info(f"Removing {invalid.sum()} duplicate or invalid rows")
+        # most values repeat many times -- store integer codes against shared dictionaries
+        paths = to_shared_categorical(paths, GENE_COLUMNS)
+        paths = to_shared_categorical(paths, CELL_TYPE_COLUMNS)
 
-        paths = paths[~invalid].reset_index(drop=True)
+        # a pathway is identified by its genes and cell types; hashing their integer
+        # codes is much cheaper than comparing every column of every row
+        duplicates_mask = paths.duplicated(subset=PATH_KEY_COLUMNS)
+        if duplicates_mask.sum() > 0:
+            logger.warning(f"{duplicates_mask.sum()} duplicate rows found")
 
-        kinase_cols = [
-            "sik_r_of_em",
-            "sik_r_of_t",
-            "sik_em_of_t",
-            "sik_em_of_r",
-            "sik_t_of_r",
-            "sik_t_of_em",
-        ]
+        invalid_count = is_na_mask.sum() + duplicates_mask.sum()
+        if invalid_count > 0:
+            logger.info(f"Removing {invalid_count} duplicate or invalid rows")
 
-        if self.has_kinase:
+        paths = paths[~duplicates_mask].reset_index(drop=True)
 
-            paths.loc[:, kinase_cols] = paths[kinase_cols].replace(
-                [0, "NA", "nan", False, np.nan], ""
-            )
+        if self.has_kinase:
+            paths, self.kinase_names = KinaseNames.encode(paths)
+        else:
+            self.kinase_names = KinaseNames({})
 
         return paths
 
@@ -489,8 +954,1049 @@ def parse_slider_values_from_tree(children):
     return out
 
 
+# kinase filter dropdown value -> sik column that must be non-empty
+KINASE_FILTER_COLUMNS = {
+    "Receptor->EM": "sik_r_of_em",
+    "Receptor->Target": "sik_r_of_t",
+    "EM->Target": "sik_em_of_t",
+    "EM->Receptor": "sik_em_of_r",
+    "Target->Receptor": "sik_t_of_r",
+    "Target->EM": "sik_t_of_em",
+}
+
+
+class PostingIndex:
+    """
+    Inverted index from the codes of a categorical column to the rows holding them
+
+    Row positions are stored grouped by code (CSR layout): rows[offsets[c + 1]:offsets[c + 2]]
+    are the sorted positions of code c, and the first slot holds missing values (code -1).
+    """
+
+    def __init__(self, codes: np.ndarray, num_categories: int):
+        shifted = codes.astype(np.int64) + 1
+        counts = np.bincount(shifted, minlength=num_categories + 1)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self.rows = np.argsort(shifted, kind="stable").astype(row_dtype(len(codes)))
+
+    def lookup(self, codes) -> np.ndarray:
+        """Sorted row positions holding any of codes"""
+        codes = np.unique(np.asarray(codes, dtype=np.int64))
+        postings = [self.rows[self.offsets[c + 1] : self.offsets[c + 2]] for c in codes]
+        if len(postings) == 1:
+            return postings[0]
+        elif not postings:
+            return np.empty(0, dtype=self.rows.dtype)
+        # postings for distinct codes are disjoint, only the order needs fixing
+        return np.sort(np.concatenate(postings))
+
+
+def row_dtype(num_rows):
+    return np.int32 if num_rows < np.iinfo(np.int32).max else np.int64
+
+
+def evaluate_range_predicate(kind, values, args) -> np.ndarray:
+    """Boolean mask for a numeric slider predicate (see SortedIndex.ranges)"""
+    if kind == "at_least":
+        return values >= args[0]
+    elif kind == "at_most":
+        return values <= args[0]
+    elif kind == "between":
+        return (values >= args[0]) & (values <= args[1])
+    elif kind == "outside":
+        return (values <= args[0]) | (values >= args[1])
+    raise ValueError(f"Unknown range predicate {kind}")
+
+
+def subtract_ranges(ranges, removed) -> list[tuple[int, int]]:
+    """[start, stop) intervals in ranges but not in removed"""
+    out = []
+    for start, stop in ranges:
+        pieces = [(start, stop)]
+        for r_start, r_stop in removed:
+            pieces = [
+                piece
+                for p_start, p_stop in pieces
+                for piece in [
+                    (p_start, min(p_stop, r_start)),
+                    (max(p_start, r_stop), p_stop),
+                ]
+                if piece[0] < piece[1]
+            ]
+        out.extend(pieces)
+    return out
+
+
+class SortedIndex:
+    """
+    Presorted positions of a numeric column
+
+    Threshold and range predicates become binary searches over the sorted values, giving
+    contiguous slices of the sort order. NaNs sort last and never match a predicate.
+    """
+
+    def __init__(self, values: np.ndarray):
+        self.order = np.argsort(values, kind="stable").astype(row_dtype(len(values)))
+        # np.searchsorted(..., sorter=order) validates the whole sorter on every call,
+        # so keep a sorted copy instead
+        self.sorted_values = values[self.order]
+        self.num_valid = len(values) - int(np.count_nonzero(np.isnan(values)))
+
+    def _search(self, value, side):
+        pos = np.searchsorted(self.sorted_values, value, side=side)
+        return min(int(pos), self.num_valid)
+
+    def ranges(self, kind, args) -> list[tuple[int, int]]:
+        """[start, stop) slices of the sort order matching the predicate"""
+        if kind == "at_least":
+            return [(self._search(args[0], "left"), self.num_valid)]
+        elif kind == "at_most":
+            return [(0, self._search(args[0], "right"))]
+        elif kind == "between":
+            start = self._search(args[0], "left")
+            return [(start, max(start, self._search(args[1], "right")))]
+        elif kind == "outside":
+            low_stop = self._search(args[0], "right")
+            high_start = self._search(args[1], "left")
+            if low_stop >= high_start:
+                return [(0, self.num_valid)]
+            return [(0, low_stop), (high_start, self.num_valid)]
+        raise ValueError(f"Unknown range predicate {kind}")
+
+    @staticmethod
+    def count(ranges) -> int:
+        return sum(stop - start for start, stop in ranges)
+
+    def rows(self, ranges) -> np.ndarray:
+        """Sorted row positions covered by ranges"""
+        return np.sort(
+            np.concatenate([self.order[start:stop] for start, stop in ranges])
+        )
+
+
+# number of fixed-width bins in the server-side histograms
+HISTOGRAM_BINS = 100
+
+
+def histogram_edges(values: list[np.ndarray], num_bins=HISTOGRAM_BINS) -> np.ndarray:
+    """Bin edges spanning the finite values of all arrays in values"""
+    finite = np.concatenate([v[np.isfinite(v)] for v in values])
+    return np.histogram_bin_edges(finite, bins=num_bins)
+
+
+class HistogramBins:
+    """
+    Bin number of every row of a numeric column, for fixed bin edges
+
+    Counting the rows of a filter result is then one bincount over their bin numbers.
+    Missing and out of range values go to an extra bin that is not reported.
+    """
+
+    def __init__(self, values: np.ndarray, edges: np.ndarray):
+        self.edges = edges
+        num_bins = len(edges) - 1
+
+        bins = np.searchsorted(edges, values, side="right") - 1
+        # the last bin is closed on the right, as in np.histogram
+        bins[values == edges[-1]] = num_bins - 1
+        bins[(bins < 0) | (bins >= num_bins) | np.isnan(values)] = num_bins
+        self.bins = bins.astype(np.min_scalar_type(num_bins))
+
+    def counts(self, rows=None) -> np.ndarray:
+        bins = self.bins if rows is None else self.bins[rows]
+        return np.bincount(bins, minlength=len(self.edges))[:-1]
+
+
+def umap_viewport(relayout_data: dict):
+    """
+    (x_range, y_range) requested by a umap relayout event, None for an unbounded axis
+
+    Returns None if the event does not touch the axes (e.g. autosize).
+    """
+    if not relayout_data:
+        return None
+
+    ranges = []
+    for axis in ["xaxis", "yaxis"]:
+        if f"{axis}.range[0]" in relayout_data:
+            ranges.append(
+                (
+                    relayout_data[f"{axis}.range[0]"],
+                    relayout_data[f"{axis}.range[1]"],
+                )
+            )
+        elif f"{axis}.range" in relayout_data:
+            ranges.append(tuple(relayout_data[f"{axis}.range"]))
+        else:
+            ranges.append(None)
+
+    if ranges == [None, None] and not any(
+        k.endswith(".autorange") for k in relayout_data
+    ):
+        return None
+
+    return tuple(ranges)
+
+
+class UmapLevelOfDetail:
+    """
+    Rows of the umap scatter to draw for a viewport, at most budget of them
+
+    Every row gets a fixed random priority and a viewport shows its highest priority
+    rows. Zooming in keeps the points already shown and fills in more of them, and
+    data within the budget is always drawn in full.
+    """
+
+    def __init__(
+        self,
+        umap1: np.ndarray,
+        umap2: np.ndarray,
+        rows: np.ndarray = None,
+        budget=UMAP_POINT_BUDGET,
+        seed=0,
+    ):
+        """rows: candidate row positions, default all rows"""
+        if rows is None:
+            rows = np.arange(len(umap1))
+        valid = rows[~(np.isnan(umap1[rows]) | np.isnan(umap2[rows]))]
+        self.budget = budget
+        self.priority_order = (
+            np.random.default_rng(seed).permutation(valid).astype(row_dtype(len(umap1)))
+        )
+        self.x = umap1[self.priority_order]
+        self.y = umap2[self.priority_order]
+
+    @property
+    def downsampled(self) -> bool:
+        return len(self.priority_order) > self.budget
+
+    def rows(self, x_range=None, y_range=None) -> np.ndarray:
+        """Sorted row positions to draw for the viewport"""
+        if x_range is None and y_range is None:
+            return np.sort(self.priority_order[: self.budget])
+
+        in_view = np.ones(len(self.priority_order), dtype=bool)
+        if x_range is not None:
+            in_view &= (self.x >= min(x_range)) & (self.x <= max(x_range))
+        if y_range is not None:
+            in_view &= (self.y >= min(y_range)) & (self.y <= max(y_range))
+
+        return np.sort(self.priority_order[np.flatnonzero(in_view)[: self.budget]])
+
+
+def fold_sankey_nodes(
+    df: pd.DataFrame,
+    link_keys: dict,
+    node_budget=SANKEY_NODE_BUDGET,
+    link_budget=SANKEY_LINK_BUDGET,
+) -> tuple[pd.DataFrame, dict]:
+    """
+    Keep the nodes of each river layer carrying the most pathways and fold the rest
+    into one "Other (n)" node per layer
+
+    link_keys: {(source layer, target layer): integer per row} for each pair of
+        adjacent layers shown; rows with different keys are drawn as separate links
+        (the link colors) even between the same two nodes
+    node_budget, link_budget: the number of nodes kept per layer is the largest, at most
+        node_budget, that leaves at most link_budget links
+
+    Every pathway still flows through one node per layer, so folded nodes carry the
+    total of the nodes they replace. Returns df with folded layer columns and the number
+    of nodes folded per layer (empty, and df unchanged, when everything fits).
+    """
+    layers = list(dict.fromkeys(col for pair in link_keys for col in pair))
+
+    ranks, nodes = {}, {}
+    for col in layers:
+        codes, uniques = pd.factorize(df[col])
+        order = np.argsort(-np.bincount(codes, minlength=len(uniques)), kind="stable")
+        # rank of each row's node, 0 for the node with the most pathways
+        ranks[col] = np.argsort(order)[codes]
+        nodes[col] = np.asarray(uniques)[order]
+
+    # distinct (source rank, key, target rank) links; folding can only merge them
+    links = []
+    for (source, target), key in link_keys.items():
+        key = np.asarray(key, dtype=np.int64)
+        num_keys = int(key.max()) + 1 if len(key) else 1
+        base = len(nodes[target])
+        combined = np.unique((ranks[source] * num_keys + key) * base + ranks[target])
+        links.append(
+            (
+                combined // base // num_keys,
+                combined // base % num_keys,
+                combined % base,
+                num_keys,
+            )
+        )
+
+    def num_links(kept):
+        return sum(
+            len(
+                np.unique(
+                    (np.minimum(s, kept) * num_keys + k) * (kept + 1)
+                    + np.minimum(t, kept)
+                )
+            )
+            for s, k, t, num_keys in links
+        )
+
+    most_nodes = max((len(n) for n in nodes.values()), default=0)
+    if most_nodes <= node_budget and sum(len(s) for s, *_ in links) <= link_budget:
+        return df, {}
+
+    # links only merge as fewer nodes are kept, so search for the most that fit
+    low, high = 1, max(min(node_budget, most_nodes), 1)
+    while low < high:
+        mid = (low + high + 1) // 2
+        if num_links(mid) <= link_budget:
+            low = mid
+        else:
+            high = mid - 1
+
+    df = df.copy(deep=False)
+    folded = {}
+    for col in layers:
+        num_folded = len(nodes[col]) - low
+        if num_folded <= 0:
+            continue
+        folded[col] = num_folded
+        df[col] = pd.Categorical.from_codes(
+            np.minimum(ranks[col], low),
+            categories=list(nodes[col][:low])
+            + [f"{SANKEY_OTHER_LABEL} ({num_folded})"],
+        )
+    return df, folded
+
+
+class FilterResult:
+    """
+    Rows selected by one filter state, plus aggregates derived from them
+
+    Aggregates (e.g. per sender/receiver counts) are memoized on the result so every
+    consumer of the same filter state shares one computation.
+    """
+
+    # rough allowance for the python objects and aggregates held alongside the rows
+    OVERHEAD_BYTES = 4096
+
+    def __init__(self, rows: np.ndarray):
+        rows.flags.writeable = False
+        self.rows = rows
+        self.aggregates = {}
+
+    @property
+    def nbytes(self):
+        return self.rows.nbytes + FilterResult.OVERHEAD_BYTES
+
+    def aggregate(self, name, compute: Callable):
+        if name not in self.aggregates:
+            self.aggregates[name] = compute()
+        return self.aggregates[name]
+
+
+class FilterResultCache:
+    """
+    LRU cache of FilterResults keyed by normalized filter state (PathwaysFilter.cache_key)
+
+    Entries are evicted least recently used first once their total size exceeds
+    max_bytes. Aggregates are small and covered by a fixed per-entry allowance.
+    """
+
+    def __init__(self, max_bytes=256 * 2**20):
+        self.max_bytes = max_bytes
+        self.nbytes = 0
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def get(self, key):
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+            return None
+
+    def put(self, key, result: FilterResult):
+        with self._lock:
+            if key in self._entries:
+                self.nbytes -= self._entries.pop(key).nbytes
+
+            if result.nbytes <= self.max_bytes:
+                self._entries[key] = result
+                self.nbytes += result.nbytes
+
+            while self.nbytes > self.max_bytes and self._entries:
+                _, evicted = self._entries.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+
+    def peek(self, key):
+        """Entry for key without touching the LRU order or hit/miss counters"""
+        with self._lock:
+            return self._entries.get(key)
+
+    def get_or_compute(self, key, compute: Callable) -> FilterResult:
+        result = self.get(key)
+        if result is None:
+            result = compute()
+            self.put(key, result)
+        return result
+
+    def stats(self):
+        return {
+            "entries": len(self._entries),
+            "nbytes": self.nbytes,
+            "max_bytes": self.max_bytes,
+            "hits": self.hits,
+            "misses": self.misses,
+        }
+
+
+class PathwaysFilterEngine:
+    """
+    Long-lived filtering structures for a single pathways frame
+
+    Built once per IncytrInput. Everything that does not depend on the filter values
+    (per-group column mappings, numeric column arrays, categorical codes and their
+    posting lists) is computed here; sorted indexes on the numeric columns are built on
+    first use. Filtering starts from the posting lists of the dropdown selections or, if
+    narrower, from the sorted index of the most selective slider, and evaluates the
+    remaining predicates only on those candidate rows.
+    """
+
+    CATEGORICAL_COLUMNS = GENE_COLUMNS + CELL_TYPE_COLUMNS
+
+    NUMERIC_COLUMNS = ["afc", "sigprob", "p_value", "tpds", "ppds", "umap1", "umap2"]
+
+    HISTOGRAM_COLUMNS = ["sigprob", "tpds", "ppds", "p_value"]
+
+    # columns the sliders and umap selections filter on, see range_predicates
+    RANGE_COLUMNS = ["sigprob", "p_value", "tpds", "ppds", "umap1", "umap2"]
+
+    # use a sorted index instead of scanning when it selects less than this fraction of
+    # the current candidates -- sorting the matched positions costs more per row than a
+    # vectorized comparison
+    INDEX_SELECTIVITY = 0.1
+
+    # sessions whose last filter state is remembered for incremental filtering
+    MAX_SESSIONS = 256
+
+    def __init__(
+        self,
+        paths: pd.DataFrame,
+        group_a_name: str,
+        group_b_name: str,
+        result_cache: FilterResultCache = None,
+        kinase_names: KinaseNames = None,
+    ):
+
+        self.paths = paths
+        self.results = result_cache or FilterResultCache()
+        self.kinase_names = kinase_names
+        self.num_rows = len(paths)
+        self.group_names = {"a": group_a_name, "b": group_b_name}
+
+        # (source column, output column) pairs for each group: columns belonging to the
+        # other group are dropped and namespaced columns lose their group suffix
+        self.group_columns = {
+            "a": self._group_columns(group_a_name, group_b_name),
+            "b": self._group_columns(group_b_name, group_a_name),
+        }
+
+        self.group_sources = {
+            group_id: {
+                name: src
+                for src, name in columns
+                if name in PathwaysFilterEngine.NUMERIC_COLUMNS
+            }
+            for group_id, columns in self.group_columns.items()
+        }
+
+        self.group_values = {
+            group_id: {name: paths[src].to_numpy() for name, src in sources.items()}
+            for group_id, sources in self.group_sources.items()
+        }
+
+        afc = paths["afc"].to_numpy()
+        self.afc_masks = {"a": afc > 0, "b": afc < 0}
+
+        self.codes = {}
+        self.postings = {}
+        for col in PathwaysFilterEngine.CATEGORICAL_COLUMNS:
+            if isinstance(paths[col].dtype, pd.CategoricalDtype):
+                # .array.codes is a view (e.g. of a memory-mapped column store),
+                # .cat.codes would be a copy
+                codes = paths[col].array.codes
+                categories = paths[col].cat.categories
+            else:
+                codes, uniques = pd.factorize(paths[col])
+                categories = pd.Index(uniques)
+            self.codes[col] = (codes, categories)
+            self.postings[col] = PostingIndex(codes, len(categories))
+
+        self._kinase_masks = {}
+        self._sorted_indexes = {}
+        self._histogram_edges = {}
+        self._histogram_bins = {}
+
+        self._sessions = OrderedDict()
+        self._sessions_lock = threading.Lock()
+
+    def _group_columns(self, own_name, other_name):
+        pattern = re.compile(f"_{own_name}$")
+        return [
+            (
+                c,
+                (
+                    re.sub(pattern, "", c)
+                    if any(c.startswith(ns) for ns in PathwaysFilter.NAMESPACED_COLUMNS)
+                    else c
+                ),
+            )
+            for c in self.paths.columns
+            if not c.endswith(f"_{other_name}")
+        ]
+
+    def path_keys(self, rows=None) -> np.ndarray:
+        """
+        Composite keys L*R*EM*T*sender*receiver of rows (positions or boolean mask)
+
+        Built from the categorical codes on demand, for rows being shown or exported
+        """
+        keys = None
+        missing = None
+        for col in PATH_KEY_COLUMNS:
+            codes, categories = self.codes[col]
+            codes = codes if rows is None else codes[rows]
+            values = np.asarray(categories, dtype=object)[codes]
+
+            missing = codes < 0 if missing is None else missing | (codes < 0)
+            keys = values if keys is None else keys + "*" + values
+
+        if missing.any():
+            keys[missing] = None
+        return keys
+
+    def group_frame(self, group_id, rows=None, display_columns=True) -> pd.DataFrame:
+        """
+        Rows (positions or boolean mask) of the pathways frame with group_id's column names
+
+        display_columns: add the columns only rebuilt on demand, as in the input file --
+            the path key, and the kinase names in place of the kinase bitmask. Figures
+            do without them
+        """
+        src, names = zip(*self.group_columns[group_id])
+        positions = [self.paths.columns.get_loc(c) for c in src]
+        df = (
+            self.paths.iloc[:, positions]
+            if rows is None
+            else self.paths.iloc[rows, positions]
+        )
+        df.columns = list(names)
+
+        if not display_columns:
+            return df
+
+        if "path" not in df.columns:
+            df.insert(
+                0,
+                "path",
+                pd.Series(
+                    self.path_keys(rows),
+                    index=df.index,
+                    dtype=self.codes["ligand"][1].dtype,
+                ),
+            )
+
+        if self.kinase_names is not None and KINASE_BITS_COLUMN in df.columns:
+            row_positions = np.arange(self.num_rows)
+            if rows is not None:
+                row_positions = row_positions[rows]
+
+            position = df.columns.get_loc(KINASE_BITS_COLUMN)
+            df = df.drop(columns=KINASE_BITS_COLUMN)
+            for i, col in enumerate(KINASE_COLUMNS):
+                df.insert(
+                    position + i,
+                    col,
+                    pd.Series(
+                        self.kinase_names.lookup(col, row_positions),
+                        index=df.index,
+                        dtype=str,
+                    ),
+                )
+        return df
+
+    def umap_points(self, rows) -> pd.DataFrame:
+        """Umap coordinates, afc and path key of rows, for drawing"""
+        points = self.paths.iloc[rows][["umap1", "umap2", "afc"]]
+        points["path"] = self.path_keys(rows)
+        return points
+
+    def value_codes(self, column, values) -> np.ndarray:
+        """Codes of the selected values in column; -1 stands for missing values"""
+        _, categories = self.codes[column]
+        values = pd.Index(values)
+        codes = categories.get_indexer(values.dropna())
+        codes = codes[codes >= 0]
+        if values.isna().any():
+            codes = np.append(codes, -1)
+        return codes
+
+    def isin(self, column, values) -> np.ndarray:
+        return self.postings[column].lookup(self.value_codes(column, values))
+
+    def memory_usage(self) -> int:
+        """
+        Bytes held by the indexes built so far and the cached filter results; the
+        column arrays are views of the pathways frame and not counted again
+        """
+        arrays = list(self.afc_masks.values()) + list(self._kinase_masks.values())
+        for posting in self.postings.values():
+            arrays += [posting.offsets, posting.rows]
+        for index in self._sorted_indexes.values():
+            arrays += [index.order, index.sorted_values]
+        for bins in self._histogram_bins.values():
+            arrays.append(bins.bins)
+        return sum(a.nbytes for a in arrays) + self.results.nbytes
+
+    def sorted_index(self, group_id, name) -> SortedIndex:
+        src = self.group_sources[group_id][name]
+        if src not in self._sorted_indexes:
+            self._sorted_indexes[src] = SortedIndex(self.group_values[group_id][name])
+        return self._sorted_indexes[src]
+
+    def histogram_edges(self, name) -> np.ndarray:
+        """Bin edges for a histogram column, shared by both groups"""
+        if name not in self._histogram_edges:
+            self._histogram_edges[name] = histogram_edges(
+                [
+                    values[name]
+                    for values in self.group_values.values()
+                    if name in values
+                ]
+            )
+        return self._histogram_edges[name]
+
+    def histogram_bins(self, group_id, name) -> HistogramBins:
+        src = self.group_sources[group_id][name]
+        if src not in self._histogram_bins:
+            self._histogram_bins[src] = HistogramBins(
+                self.group_values[group_id][name], self.histogram_edges(name)
+            )
+        return self._histogram_bins[src]
+
+    def histograms(self, group_id, result: FilterResult) -> dict:
+        """Per-bin counts of result's rows for each histogram column, memoized on result"""
+        return result.aggregate(
+            "histograms",
+            lambda: {
+                name: self.histogram_bins(group_id, name).counts(result.rows)
+                for name in PathwaysFilterEngine.HISTOGRAM_COLUMNS
+                if name in self.group_sources[group_id]
+            },
+        )
+
+    def range_predicates(self, group_id, pf: "PathwaysFilter", should_filter_umap):
+        """(column, kind, args) for each active slider and umap filter"""
+        predicates = []
+
+        if should_filter_umap:
+            filter_umap = pf.filter_umap_a if group_id == "a" else pf.filter_umap_b
+            if filter_umap.get("xaxis.range[0]"):
+                predicates.append(
+                    (
+                        "umap1",
+                        "between",
+                        (filter_umap["xaxis.range[0]"], filter_umap["xaxis.range[1]"]),
+                    )
+                )
+            if filter_umap.get("yaxis.range[0]"):
+                predicates.append(
+                    (
+                        "umap2",
+                        "between",
+                        (filter_umap["yaxis.range[0]"], filter_umap["yaxis.range[1]"]),
+                    )
+                )
+
+        if pf.sp_threshold is not None:
+            predicates.append(("sigprob", "at_least", (pf.sp_threshold,)))
+
+        if pf.pval_threshold:
+            predicates.append(("p_value", "at_most", (pf.pval_threshold,)))
+
+        if pf.ppds_bounds:
+            predicates.append(("ppds", "outside", tuple(pf.ppds_bounds[0:2])))
+
+        if pf.tppds_bounds:
+            predicates.append(("tpds", "outside", tuple(pf.tppds_bounds[0:2])))
+
+        # compare float columns in their own precision (float32 in compact mode), so
+        # scans and sorted index searches agree on values that round to the threshold.
+        # Integer columns compare against the threshold as given, not truncated to it
+        values = self.group_values[group_id]
+        return [
+            (
+                name,
+                kind,
+                (
+                    tuple(values[name].dtype.type(a) for a in args)
+                    if name in values and values[name].dtype.kind == "f"
+                    else args
+                ),
+            )
+            for name, kind, args in predicates
+        ]
+
+    def warm(self):
+        """
+        Build the sorted indexes, histogram bins and kinase masks now rather than on
+        first use, e.g. before forking workers that would otherwise each build their own
+        """
+        for group_id, sources in self.group_sources.items():
+            for name in sources:
+                if name in PathwaysFilterEngine.RANGE_COLUMNS:
+                    self.sorted_index(group_id, name)
+                if name in PathwaysFilterEngine.HISTOGRAM_COLUMNS:
+                    self.histogram_bins(group_id, name)
+
+        if KINASE_BITS_COLUMN in self.paths.columns:
+            for column in KINASE_COLUMNS:
+                self.kinase_mask(column)
+
+    def kinase_mask(self, column) -> np.ndarray:
+        if column not in self._kinase_masks:
+            bits = self.paths[KINASE_BITS_COLUMN].to_numpy()
+            self._kinase_masks[column] = (bits & kinase_bit(column)) != 0
+        return self._kinase_masks[column]
+
+    def predicates(self, group_id, pf: "PathwaysFilter", should_filter_umap=False):
+        """
+        Normalized predicates of pf for group_id, keyed by name
+
+        Each value is a hashable spec: ("afc",), ("range", column, kind, args),
+        ("isin", column, codes), ("any_role", values) or ("kinase", column). Two filter
+        states can be diffed predicate by predicate by comparing these dicts.
+        """
+        predicates = {}
+
+        if pf.filter_afc_direction:
+            predicates["afc"] = ("afc",)
+
+        for name, kind, args in self.range_predicates(group_id, pf, should_filter_umap):
+            predicates[name] = ("range", name, kind, tuple(args))
+
+        for col, selected in [
+            ("ligand", pf.filter_ligands),
+            ("receptor", pf.filter_receptors),
+            ("em", pf.filter_em),
+            ("target", pf.filter_target_genes),
+            ("sender", pf.filter_senders),
+            ("receiver", pf.filter_receivers),
+        ]:
+            if len(selected):
+                predicates[col] = (
+                    "isin",
+                    col,
+                    frozenset(self.value_codes(col, selected).tolist()),
+                )
+
+        if pf.filter_all_molecules:
+            predicates["any_role"] = ("any_role", frozenset(pf.filter_all_molecules))
+
+        if pf.filter_kinase in KINASE_FILTER_COLUMNS:
+            predicates["kinase"] = ("kinase", KINASE_FILTER_COLUMNS[pf.filter_kinase])
+
+        return predicates
+
+    def _code_lookup(self, column, codes) -> np.ndarray:
+        # one extra slot so code -1 (missing) indexes the last entry
+        lookup = np.zeros(len(self.codes[column][1]) + 1, dtype=bool)
+        lookup[np.fromiter(codes, dtype=np.int64, count=len(codes))] = True
+        return lookup
+
+    def evaluate(self, group_id, spec, rows=None) -> np.ndarray:
+        """Boolean mask of one predicate over rows (every row if None)"""
+
+        def take(arr):
+            return arr if rows is None else arr[rows]
+
+        kind = spec[0]
+        if kind == "afc":
+            return take(self.afc_masks[group_id])
+        elif kind == "range":
+            _, name, range_kind, args = spec
+            return evaluate_range_predicate(
+                range_kind, take(self.group_values[group_id][name]), args
+            )
+        elif kind == "isin":
+            _, col, codes = spec
+            return self._code_lookup(col, codes)[take(self.codes[col][0])]
+        elif kind == "any_role":
+            mask = np.zeros(self.num_rows if rows is None else len(rows), dtype=bool)
+            for col in GENE_COLUMNS:
+                codes = self.value_codes(col, list(spec[1])).tolist()
+                mask |= self._code_lookup(col, codes)[take(self.codes[col][0])]
+            return mask
+        elif kind == "kinase":
+            if KINASE_BITS_COLUMN in self.paths.columns:
+                return take(self.kinase_mask(spec[1]))
+            logger.warning(
+                f"kinase column {spec[1]} not detected -- please check input"
+            )
+            return np.zeros(self.num_rows if rows is None else len(rows), dtype=bool)
+        raise ValueError(f"Unknown predicate {spec}")
+
+    def posting_rows(self, spec) -> np.ndarray:
+        """Sorted rows matching an isin/any_role predicate, from the posting lists"""
+        if spec[0] == "isin":
+            return self.postings[spec[1]].lookup(list(spec[2]))
+
+        rows = self.isin(GENE_COLUMNS[0], list(spec[1]))
+        for col in GENE_COLUMNS[1:]:
+            rows = np.union1d(rows, self.isin(col, list(spec[1])))
+        return rows
+
+    def passing(self, group_id, predicates: dict, rows: np.ndarray) -> np.ndarray:
+        """The subset of rows passing every predicate, evaluated directly on rows"""
+        mask = np.ones(len(rows), dtype=bool)
+        for spec in predicates.values():
+            mask &= self.evaluate(group_id, spec, rows)
+        return rows[mask]
+
+    def rows(self, group_id, pf: "PathwaysFilter", should_filter_umap=False):
+        """Sorted positions of the rows in group_id passing every filter in pf"""
+        return self.predicate_rows(
+            group_id, self.predicates(group_id, pf, should_filter_umap)
+        )
+
+    def predicate_rows(self, group_id, predicates: dict) -> np.ndarray:
+        predicates = dict(predicates)
+        candidates = None
+
+        def _intersect(candidates, rows):
+            if candidates is None:
+                return rows
+            return np.intersect1d(candidates, rows, assume_unique=True)
+
+        # dropdown selections resolve through the posting lists
+        for name in [n for n, s in predicates.items() if s[0] in ("isin", "any_role")]:
+            candidates = _intersect(candidates, self.posting_rows(predicates.pop(name)))
+
+        # start from the most selective slider if its index beats the current candidates
+        ranged = [n for n, s in predicates.items() if s[0] == "range"]
+        if ranged:
+            indexed = {}
+            for name in ranged:
+                _, col, kind, args = predicates[name]
+                index = self.sorted_index(group_id, col)
+                indexed[name] = (index, index.ranges(kind, args))
+            best = min(ranged, key=lambda n: SortedIndex.count(indexed[n][1]))
+
+            index, ranges = indexed[best]
+            num_candidates = self.num_rows if candidates is None else len(candidates)
+            if (
+                SortedIndex.count(ranges)
+                < num_candidates * PathwaysFilterEngine.INDEX_SELECTIVITY
+            ):
+                candidates = _intersect(candidates, index.rows(ranges))
+                predicates.pop(best)
+
+        if candidates is None:
+            mask = np.ones(self.num_rows, dtype=bool)
+            for spec in predicates.values():
+                mask &= self.evaluate(group_id, spec)
+            return np.flatnonzero(mask)
+
+        return self.passing(group_id, predicates, candidates)
+
+    def admitted_rows(self, group_id, old_spec, new_spec):
+        """
+        Superset of the rows that pass new_spec but not old_spec, or None if that set
+        cannot be found without a scan
+        """
+        if old_spec[0] != new_spec[0]:
+            return None
+
+        kind = new_spec[0]
+        if kind == "range" and old_spec[1] == new_spec[1]:
+            index = self.sorted_index(group_id, new_spec[1])
+            ranges = subtract_ranges(
+                index.ranges(new_spec[2], new_spec[3]),
+                index.ranges(old_spec[2], old_spec[3]),
+            )
+            return index.rows(ranges) if ranges else np.empty(0, dtype=np.int64)
+        elif kind == "isin" and old_spec[1] == new_spec[1]:
+            return self.postings[new_spec[1]].lookup(list(new_spec[2] - old_spec[2]))
+        elif kind == "any_role":
+            added = new_spec[1] - old_spec[1]
+            if not added:
+                return np.empty(0, dtype=np.int64)
+            return self.posting_rows(("any_role", added))
+        elif kind == "kinase":
+            return np.flatnonzero(self.kinase_mask(new_spec[1]))
+        return None
+
+    def incremental_rows(self, group_id, old_predicates, old_rows, new_predicates):
+        """
+        Rows for new_predicates derived from the result for old_predicates
+
+        Handles the interactive case of a single changed control. Rows already shown are
+        re-checked against the changed predicate only; if the change loosens the filter,
+        the newly admitted rows (found through the posting lists or sorted index) are
+        checked against every predicate and merged in. Returns None when the change
+        can't be applied incrementally and a full filter is needed.
+        """
+        changed = [
+            name
+            for name in set(old_predicates) | set(new_predicates)
+            if old_predicates.get(name) != new_predicates.get(name)
+        ]
+        if len(changed) != 1:
+            return None
+
+        name = changed[0]
+        old_spec, new_spec = old_predicates.get(name), new_predicates.get(name)
+
+        # a dropped predicate lets back in every row it excluded
+        if new_spec is None:
+            return None
+
+        kept = old_rows[self.evaluate(group_id, new_spec, old_rows)]
+
+        # a new predicate can only tighten
+        if old_spec is None:
+            return kept
+
+        admitted = self.admitted_rows(group_id, old_spec, new_spec)
+        if admitted is None or (
+            len(admitted) > self.num_rows * PathwaysFilterEngine.INDEX_SELECTIVITY
+        ):
+            return None
+
+        admitted = self.passing(group_id, new_predicates, admitted)
+        if len(admitted) == 0:
+            return kept
+        return np.union1d(kept, admitted)
+
+    def filter_result(
+        self,
+        group_id,
+        pf: "PathwaysFilter",
+        should_filter_umap=False,
+        session_id=None,
+    ) -> FilterResult:
+        """
+        Cached FilterResult for pf
+
+        On a cache miss with a session_id, the session's previous result for group_id is
+        refined incrementally when possible; otherwise the rows are filtered from scratch.
+        """
+        key = pf.cache_key(group_id, should_filter_umap)
+
+        result = self.results.get(key)
+        if result is not None:
+            self._remember(session_id, group_id, key, pf, should_filter_umap)
+            return result
+
+        predicates = self.predicates(group_id, pf, should_filter_umap)
+
+        rows = None
+        previous = self._sessions.get(session_id, {}).get(group_id)
+        if previous is not None:
+            previous_key, previous_predicates = previous
+            previous_result = self.results.peek(previous_key)
+            if previous_result is not None:
+                rows = self.incremental_rows(
+                    group_id, previous_predicates, previous_result.rows, predicates
+                )
+
+        if rows is None:
+            rows = self.predicate_rows(group_id, predicates)
+
+        result = FilterResult(rows)
+        self.results.put(key, result)
+        self._remember(session_id, group_id, key, predicates=predicates)
+
+        return result
+
+    def _remember(
+        self,
+        session_id,
+        group_id,
+        key,
+        pf=None,
+        should_filter_umap=False,
+        predicates=None,
+    ):
+        """Record the last filter state per session; only the cache key is held"""
+        if session_id is None:
+            return
+
+        if predicates is None:
+            predicates = self.predicates(group_id, pf, should_filter_umap)
+
+        with self._sessions_lock:
+            self._sessions.setdefault(session_id, {})[group_id] = (key, predicates)
+            self._sessions.move_to_end(session_id)
+            while len(self._sessions) > PathwaysFilterEngine.MAX_SESSIONS:
+                self._sessions.popitem(last=False)
+
+    def sender_receiver_counts(self, result: FilterResult) -> pd.Series:
+        """
+        Number of pathways per (sender, receiver) pair in result, as groupby(...).size()
+
+        Counted with one bincount over combined sender/receiver codes and memoized on
+        the result, so the network view's max and edges share one computation.
+        """
+
+        def _count():
+            sender_codes, senders = self.codes["sender"]
+            receiver_codes, receivers = self.codes["receiver"]
+            sender_codes = sender_codes[result.rows].astype(np.int64)
+            receiver_codes = receiver_codes[result.rows].astype(np.int64)
+
+            valid = (sender_codes >= 0) & (receiver_codes >= 0)
+            cube = np.bincount(
+                sender_codes[valid] * len(receivers) + receiver_codes[valid],
+                minlength=len(senders) * len(receivers),
+            )
+            pairs = np.flatnonzero(cube)
+            index = pd.MultiIndex.from_arrays(
+                [
+                    senders[pairs // len(receivers)],
+                    receivers[pairs % len(receivers)],
+                ],
+                names=["sender", "receiver"],
+            )
+            counts = pd.Series(cube[pairs], index=index)
+
+            # groupby orders categoricals by code and anything else by value
+            if not all(
+                isinstance(self.paths[c].dtype, pd.CategoricalDtype)
+                for c in CELL_TYPE_COLUMNS
+            ):
+                counts = counts.sort_index()
+            return counts
+
+        return result.aggregate("sender_receiver_counts", _count)
+
+
 @dataclass
 class PathwaysFilter:
+    """
+    Filter values for a single request
+
+    Empty selections mean "no filter" for that field. The filtering itself is done by a
+    PathwaysFilterEngine -- pass the one owned by IncytrInput to avoid rebuilding it.
+    """
 
     NAMESPACED_COLUMNS = ["sigprob", "p_value", "siks_score"]
 
@@ -512,29 +2018,29 @@ class PathwaysFilter:
     filter_all_molecules: list[str] = field(default_factory=list)
     filter_umap_a: dict = field(default_factory=dict)
     filter_umap_b: dict = field(default_factory=dict)
+    engine: PathwaysFilterEngine = None
 
     def __post_init__(self):
 
         self.a_suffix = f"_{self.group_a_name}"
         self.b_suffix = f"_{self.group_b_name}"
 
-        if not self.filter_senders:
-            self.filter_senders = self.all_paths["sender"].unique()
-
-        if not self.filter_receivers:
-            self.filter_receivers = self.all_paths["receiver"].unique()
-
-        if not self.filter_ligands:
-            self.filter_ligands = self.all_paths["ligand"].unique()
-
-        if not self.filter_receptors:
-            self.filter_receptors = self.all_paths["receptor"].unique()
-
-        if not self.filter_em:
-            self.filter_em = self.all_paths["em"].unique()
-
-        if not self.filter_target_genes:
-            self.filter_target_genes = self.all_paths["target"].unique()
+        for attr in [
+            "filter_senders",
+            "filter_receivers",
+            "filter_ligands",
+            "filter_receptors",
+            "filter_em",
+            "filter_target_genes",
+            "filter_all_molecules",
+        ]:
+            if getattr(self, attr) is None:
+                setattr(self, attr, [])
+
+        if self.engine is None:
+            self.engine = PathwaysFilterEngine(
+                self.all_paths, self.group_a_name, self.group_b_name
+            )
 
     def get_namespaced_columns(self):
         return [
@@ -545,114 +2051,100 @@ class PathwaysFilter:
 
     @property
     def a_data(self):
-        df = self.all_paths.loc[:, ~self.all_paths.columns.str.endswith(self.b_suffix)]
-        if self.filter_afc_direction:
-            df = df.loc[df["afc"] > 0]
-        pattern = re.compile(f"_{self.group_a_name}$")
-
-        return df.rename(
-            columns=lambda x: (
-                re.sub(pattern, "", x) if x in self.get_namespaced_columns() else x
-            )
+        return self.engine.group_frame(
+            "a", self.engine.afc_masks["a"] if self.filter_afc_direction else None
         )
 
     @property
     def b_data(self):
-        df = self.all_paths.loc[
-            :, ~self.all_paths.columns.str.endswith(self.a_suffix)
-        ].copy()
-
-        if self.filter_afc_direction:
-            df = df.loc[df["afc"] < 0]
-
-        pattern = re.compile(f"_{self.group_b_name}$")
-
-        return df.rename(
-            columns=lambda x: (
-                re.sub(pattern, "", x) if x in self.get_namespaced_columns() else x
-            )
+        return self.engine.group_frame(
+            "b", self.engine.afc_masks["b"] if self.filter_afc_direction else None
         )
 
-    def filter(self, group_id, should_filter_umap=False):
-        if group_id == "a":
-            df = self.a_data
-            filter_umap = self.filter_umap_a
-        elif group_id == "b":
-            df = self.b_data
-            filter_umap = self.filter_umap_b
-
-        if should_filter_umap:
-            if filter_umap.get("xaxis.range[0]"):
-                df = df.loc[
-                    (
-                        (df["umap1"] >= filter_umap["xaxis.range[0]"])
-                        & (df["umap1"] <= filter_umap["xaxis.range[1]"])
-                    ),
-                    :,
-                ]
-            if filter_umap.get("yaxis.range[0]"):
-                df = df.loc[
-                    (
-                        (df["umap2"] >= filter_umap["yaxis.range[0]"])
-                        & (df["umap2"] <= filter_umap["yaxis.range[1]"])
-                    ),
-                    :,
-                ]
-
-        df = df[df["sigprob"] >= self.sp_threshold]
-
-        if self.pval_threshold:
-            df = df[df["p_value"] <= self.pval_threshold]
+    def cache_key(self, group_id, should_filter_umap=False):
+        """
+        Hash of the filter state that affects group_id's rows
 
-        if self.ppds_bounds:
-            df = df[
-                (df["ppds"] <= self.ppds_bounds[0])
-                | (df["ppds"] >= self.ppds_bounds[1])
-            ]
-        if self.tppds_bounds:
-            df = df[
-                (df["tpds"] <= self.tppds_bounds[0])
-                | (df["tpds"] >= self.tppds_bounds[1])
-            ]
-        df = df[
-            df["ligand"].isin(self.filter_ligands)
-            & df["receptor"].isin(self.filter_receptors)
-            & df["em"].isin(self.filter_em)
-            & df["target"].isin(self.filter_target_genes)
-            & df["sender"].isin(self.filter_senders)
-            & df["receiver"].isin(self.filter_receivers)
-        ]
-        if self.filter_all_molecules:
-            df = df[
-                df["ligand"].isin(self.filter_all_molecules)
-                | df["receptor"].isin(self.filter_all_molecules)
-                | df["em"].isin(self.filter_all_molecules)
-                | df["target"].isin(self.filter_all_molecules)
-            ]
+        Values are normalized the way PathwaysFilterEngine.rows interprets them (selection
+        order ignored, falsy thresholds meaning "no filter", umap ranges only when applied)
+        so equivalent requests share a key.
+        """
 
-        if self.filter_kinase:
-            val = self.filter_kinase
+        filter_umap = self.filter_umap_a if group_id == "a" else self.filter_umap_b
+        umap_ranges = {}
+        if should_filter_umap:
+            for axis in ["xaxis", "yaxis"]:
+                if filter_umap.get(f"{axis}.range[0]"):
+                    umap_ranges[axis] = [
+                        filter_umap[f"{axis}.range[0]"],
+                        filter_umap[f"{axis}.range[1]"],
+                    ]
+
+        def _selection(values):
+            return sorted(str(v) for v in values) if len(values) else []
+
+        state = {
+            "group": group_id,
+            "afc_direction": bool(self.filter_afc_direction),
+            "sigprob": self.sp_threshold,
+            "p_value": self.pval_threshold or None,
+            "ppds": list(self.ppds_bounds[0:2]) if self.ppds_bounds else [],
+            "tpds": list(self.tppds_bounds[0:2]) if self.tppds_bounds else [],
+            "kinase": (
+                self.filter_kinase
+                if self.filter_kinase in KINASE_FILTER_COLUMNS
+                else None
+            ),
+            "senders": _selection(self.filter_senders),
+            "receivers": _selection(self.filter_receivers),
+            "ligands": _selection(self.filter_ligands),
+            "receptors": _selection(self.filter_receptors),
+            "em": _selection(self.filter_em),
+            "targets": _selection(self.filter_target_genes),
+            "all_molecules": _selection(self.filter_all_molecules),
+            "umap": umap_ranges,
+        }
+
+        return hashlib.sha1(
+            json.dumps(state, sort_keys=True, default=str).encode()
+        ).hexdigest()
+
+    def filter_result(
+        self, group_id, should_filter_umap=False, session_id=None
+    ) -> FilterResult:
+        return self.engine.filter_result(
+            group_id, self, should_filter_umap, session_id=session_id
+        )
 
-            try:
-                if val == "Receptor->EM":
-                    df = df[~(df["sik_r_of_em"] == "")]
-                elif val == "Receptor->Target":
-                    df = df[~(df["sik_r_of_t"] == "")]
-                elif val == "EM->Target":
-                    df = df[~(df["sik_em_of_t"] == "")]
-                elif val == "EM->Receptor":
-                    df = df[~(df["sik_em_of_r"] == "")]
-                elif val == "Target->Receptor":
-                    df = df[~(df["sik_t_of_r"] == "")]
-                elif val == "Target->EM":
-                    df = df[~(df["sik_t_of_em"] == "")]
-            except KeyError:
-                logger.warning(
-                    f"kinase column not detected for {val} -- please check input"
-                )
-                df = df.iloc[0:0]
+    # fields describing the dataset rather than the filter values
+    DATASET_FIELDS = ["all_paths", "group_a_name", "group_b_name", "engine"]
+
+    def filter_state(self) -> dict:
+        """The filter values as a json serializable dict (see from_filter_state)"""
+        return {
+            f.name: getattr(self, f.name)
+            for f in fields(self)
+            if f.name not in PathwaysFilter.DATASET_FIELDS
+        }
+
+    @classmethod
+    def from_filter_state(cls, incytr_input: IncytrInput, state: dict):
+        """Rebuild a filter for incytr_input from filter_state(); unknown keys are ignored"""
+        known = {
+            f.name for f in fields(cls) if f.name not in PathwaysFilter.DATASET_FIELDS
+        }
+        return cls(
+            all_paths=incytr_input.paths,
+            group_a_name=incytr_input.group_a,
+            group_b_name=incytr_input.group_b,
+            engine=incytr_input.filter_engine,
+            **{k: v for k, v in state.items() if k in known},
+        )
 
-        return df
+    def filter(self, group_id, should_filter_umap=False):
+        return self.engine.group_frame(
+            group_id, self.filter_result(group_id, should_filter_umap).rows
+        )
 
 
 def update_filter_value(current, new):
@@ -660,13 +2152,22 @@ def update_filter_value(current, new):
 
 
 def edge_width_map(
-    pathways: int, global_max_paths: int, edge_scale_factor, max_width_px: int = 10
+    pathways, global_max_paths: int, edge_scale_factor, max_width_px: int = 10
 ):
+    """
+    Edge width for a number of pathways, or a list of widths for an array of counts
+    """
     floor = 2
-    pixels = (
-        max((pathways / global_max_paths * max_width_px), floor) ** edge_scale_factor
-    )
-    return str(pixels) + "px"
+    if np.ndim(pathways) == 0:
+        pixels = (
+            max((pathways / global_max_paths * max_width_px), floor)
+            ** edge_scale_factor
+        )
+        return str(pixels) + "px"
+
+    # scale in bulk; the power is left to python floats so widths match the scalar path
+    scaled = np.asarray(pathways) / global_max_paths * max_width_px
+    return [str(max(x, floor) ** edge_scale_factor) + "px" for x in scaled.tolist()]
 
 
 def get_node_colors(ids):
@@ -677,7 +2178,14 @@ def get_node_colors(ids):
         "em": "green",
         "target": "purple",
     }
-    return [colors[x.split("_")[1]] for x in ids]
+    return [
+        (
+            "lightgrey"
+            if x.startswith(SANKEY_OTHER_LABEL + " (")
+            else colors[x.split("_")[1]]
+        )
+        for x in ids
+    ]
 
 
 def log_base(x, base):
@@ -1,26 +1,91 @@
+import gc
 import sys
+import threading
 import time
 
 import gunicorn.app.base
 from gunicorn.arbiter import Arbiter
 
-from incytr_viz.app import create_app
+from incytr_viz.app import create_app, input_source
+from incytr_viz.reload import InputWatcher, ReloadableInput
 from incytr_viz.util import ascii, create_logger
 
 logger = create_logger(__name__)
 
 
 class CustomArbiter(Arbiter):
+    """
+    SIGHUP reloads the input files instead of stopping the server
+
+    The data lives in the master and is rebuilt there in a background thread while the
+    workers keep serving. Once it is swapped in, new workers are forked from the master
+    and the old ones finish their requests and exit. A catalogue app loads its datasets
+    in the workers, so for it SIGHUP just replaces the workers, which load each dataset
+    from its current files on first use.
+
+    watch_seconds: poll the input files from the master's loop rather than a thread
+
+    Workers that exit during a reload are replaced as usual. The reload thread forks
+    nothing itself (its parsing processes come from a forkserver, see ingest), and the
+    locks a worker could find held by it (logging, imports) are reset by Python in the
+    forked child. Only the swap to new workers waits for the thread to finish.
+    """
+
+    def __init__(self, app, watch_seconds=None):
+        super().__init__(app)
+        self._swapped = threading.Event()
+        self.source = input_source(app.application)
+        self.watch_seconds = watch_seconds
+        self._next_watch = time.monotonic() + (watch_seconds or 0)
+        if isinstance(self.source, ReloadableInput):
+            self.source.on_swap.append(lambda _: self.replace_workers())
 
     def handle_hup(self):
-        self.handle_term()
+        if not isinstance(self.source, ReloadableInput):
+            logger.info("Hang up: replacing workers")
+            self.reload()
+        elif self.source.reload(force=True) is None:
+            logger.info("Hang up: a reload is already running")
+        else:
+            logger.info("Hang up: reloading input files")
+
+    def replace_workers(self):
+        """Fork new workers from the reloaded data; called from the reload thread"""
+        self._swapped.set()
+        self.wakeup()
+
+    def watch(self):
+        if not self.watch_seconds or time.monotonic() < self._next_watch:
+            return
+        self._next_watch = time.monotonic() + self.watch_seconds
+        try:
+            self.source.reload()
+        except Exception:
+            logger.exception("Could not check the input files for changes")
+
+    def manage_workers(self):
+        if isinstance(self.source, ReloadableInput):
+            self.watch()
+
+        if self._swapped.is_set() and not self.source.reloading:
+            self._swapped.clear()
+            # as at startup, keep the collector off the pages shared with the workers;
+            # unfrozen first so objects of the previous data can be collected
+            gc.unfreeze()
+            gc.collect()
+            gc.freeze()
+            # spawns a new set of workers, then stops the old ones gracefully
+            self.reload()
+            return
+        super().manage_workers()
 
 
 class StandaloneApplication(gunicorn.app.base.BaseApplication):
 
-    def __init__(self, app, options=None):
+    def __init__(self, app, options=None, watch_seconds=None):
         self.options = options or {}
         self.application = app
+        self.watch_seconds = watch_seconds
         super().__init__()
 
     def load_config(self):
@@ -47,24 +112,76 @@ class StandaloneApplication(gunicorn.app.base.BaseApplication):
         logger.info(f"Running incytr-viz with gunicorn at {location}")
 
         try:
-            CustomArbiter(self).run()
+            CustomArbiter(self, watch_seconds=self.watch_seconds).run()
         except RuntimeError as e:
             print("\nError: %s\n" % e, file=sys.stderr)
             sys.stderr.flush()
             sys.exit(1)
 
 
-def run_gunicorn(pathways, clusters):
+def gunicorn_options(workers=1, threads=1, worker_class="sync") -> dict:
+    """
+    Gunicorn settings for StandaloneApplication; kept in its options, rather than set
+    on its config, so they are applied again when a reload reloads the config
+    """
+    return {
+        "workers": workers,
+        "threads": threads,
+        "worker_class": worker_class,
+        "preload_app": True,
+        "loglevel": "warning",
+    }
+
+
+def run_gunicorn(
+    pathways,
+    clusters,
+    workers=1,
+    threads=1,
+    worker_class="sync",
+    watch_seconds=None,
+    **input_options,
+):
 
     print(ascii())
     time.sleep(1)
-    app = create_app(pathways_file=pathways, clusters_file=clusters)
-
-    g_app = StandaloneApplication(app=app)
-
-    try:
-        g_app.cfg.settings["loglevel"].value = "warning"
-    except:
-        logger.warning("Could not set gunicorn loglevel")
-
+    app = create_app(pathways_file=pathways, clusters_file=clusters, **input_options)
+    source = input_source(app)
+
+    # the dataset is loaded once here, in the master, and shared with the forked
+    # workers copy-on-write, along with the filter indexes and umap points built by
+    # warm() (and again for each reload, before the new workers are forked). Only the
+    # filter result cache (--filter-cache-mb) is filled per worker. Freezing moves
+    # everything allocated so far out of the garbage collector's reach, so
+    # collections in the workers don't write to (and copy) the pages holding the
+    # dataset's python objects. A catalogue app loads its datasets on first use, in
+    # each worker, sharing only the memory-mapped caches
+    if isinstance(source, ReloadableInput):
+        source.current.warm()
+        source.on_swap.append(lambda incytr_input: incytr_input.warm())
+    gc.collect()
+    gc.freeze()
+
+    options = gunicorn_options(
+        workers=workers, threads=threads, worker_class=worker_class
+    )
+
+    master_watch_seconds = None
+    if watch_seconds:
+        if isinstance(source, ReloadableInput):
+            # reloads in the master, see CustomArbiter
+            master_watch_seconds = watch_seconds
+        else:
+            # each worker watches the datasets it has loaded
+            options["post_fork"] = lambda server, worker: InputWatcher(
+                source, watch_seconds
+            ).start()
+
+    g_app = StandaloneApplication(
+        app=app, options=options, watch_seconds=master_watch_seconds
+    )
+
+    logger.info(
+        f"Starting {workers} gunicorn worker(s) ({worker_class}) with {threads} thread(s) each"
+    )
     g_app.run()
@@ -1,14 +1,29 @@
 import waitress
 
-from incytr_viz.app import create_app
+from incytr_viz.app import create_app, input_source
+from incytr_viz.reload import InputWatcher
 from incytr_viz.util import create_logger
 
 logger = create_logger(__name__)
 
 
-def run_waitress(pathways, clusters):
+def run_waitress(
+    pathways,
+    clusters,
+    workers=1,
+    threads=4,
+    worker_class=None,
+    watch_seconds=None,
+    **input_options,
+):
+    """waitress serves from a single process; only threads applies"""
+
+    if workers != 1 or worker_class is not None:
+        logger.warning("waitress runs a single process: ignoring workers/worker class")
 
     port = 8000
-    app = create_app(pathways_file=pathways, clusters_file=clusters)
+    app = create_app(pathways_file=pathways, clusters_file=clusters, **input_options)
+    if watch_seconds:
+        InputWatcher(input_source(app), watch_seconds).start()
     logger.info(f"Running with waitress wsgi at http://127.0.0.1:{port}")
-    waitress.serve(app, port=port)
+    waitress.serve(app, port=port, threads=threads)
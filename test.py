@@ -1,11 +1,41 @@
+import io
+import json
 import os
+import shutil
+import threading
+import zipfile
 
+import numpy as np
 import pandas as pd
 import pytest
 
 import incytr_viz.dtypes
+import incytr_viz.ingest
+from incytr_viz.cache import cache_dir_for
+from incytr_viz.column_store import read_column_store, write_column_store
 from incytr_viz.app import create_app, load_edges, load_nodes
-from incytr_viz.util import IncytrInput, PathwaysFilter
+from incytr_viz.export import stream_export_archive
+from incytr_viz.ingest import byte_ranges
+from incytr_viz.registry import DatasetRegistry, discover_datasets
+from incytr_viz.reload import ReloadableInput
+from incytr_viz.util import (
+    GENE_COLUMNS,
+    KINASE_COLUMNS,
+    HistogramBins,
+    IncytrInput,
+    KinaseNames,
+    LoadFilter,
+    PathwaysFilter,
+    PostingIndex,
+    SortedIndex,
+    UmapLevelOfDetail,
+    evaluate_range_predicate,
+    fold_sankey_nodes,
+    histogram_edges,
+    kinase_bit,
+    to_compact_dtypes,
+    umap_viewport,
+)
 
 
 @pytest.fixture
@@ -84,7 +114,6 @@ def test_incytr_input(incytr_input, formatted_pathways):
 def test_get_pathways(incytr_input):
 
     expected_columns = [
-        "path",
         "sender",
         "receiver",
         "sigprob_5x",
@@ -92,12 +121,7 @@ def test_get_pathways(incytr_input):
         "afc",
         "p_value_5x",
         "p_value_wt",
-        "sik_r_of_em",
-        "sik_r_of_t",
-        "sik_em_of_t",
-        "sik_em_of_r",
-        "sik_t_of_r",
-        "sik_t_of_em",
+        "sik_bits",
         "tpds",
         "ppds",
         "ligand",
@@ -108,6 +132,15 @@ def test_get_pathways(incytr_input):
 
     assert all(x in incytr_input.paths.columns for x in expected_columns)
 
+    # the path key and kinase names are rebuilt for display and export
+    a_paths = incytr_input.filter_engine.group_frame("a")
+    assert "path" not in incytr_input.paths.columns
+    assert all(x in a_paths.columns for x in ["path"] + KINASE_COLUMNS)
+    assert "sik_bits" not in a_paths.columns
+    assert a_paths["path"].iloc[0] == "*".join(
+        a_paths[["ligand", "receptor", "em", "target", "sender", "receiver"]].iloc[0]
+    )
+
     assert incytr_input.has_p_value == True
     assert incytr_input.has_ppds == True
     assert incytr_input.has_tpds == True
@@ -116,6 +149,439 @@ def test_get_pathways(incytr_input):
     assert incytr_input.group_b == "wt"
 
 
+def test_pathways_cache(tmp_path, clusters, pathways, mocker):
+    clusters_copy = shutil.copy(clusters, str(tmp_path / "clusters.csv"))
+    pathways_copy = shutil.copy(pathways, str(tmp_path / "pathways.csv"))
+
+    load_spy = mocker.spy(IncytrInput, "load")
+
+    first = IncytrInput(clusters_copy, pathways_copy, use_cache=True)
+    second = IncytrInput(clusters_copy, pathways_copy, use_cache=True)
+
+    assert load_spy.call_count == 1
+    pd.testing.assert_frame_equal(first.paths, second.paths)
+    pd.testing.assert_frame_equal(first.clusters, second.clusters)
+    pd.testing.assert_index_equal(first.raw_headers, second.raw_headers)
+    assert (first.group_a, first.has_p_value) == (second.group_a, second.has_p_value)
+    rows = np.arange(len(first.paths))
+    for col in KINASE_COLUMNS:
+        assert np.array_equal(
+            first.kinase_names.lookup(col, rows), second.kinase_names.lookup(col, rows)
+        )
+
+    # the cache holds json, npy and npz files only, never a pickle
+    cache_files = [
+        f for _, _, files in os.walk(cache_dir_for(pathways_copy)) for f in files
+    ]
+    assert not any(f.endswith(".pkl") for f in cache_files)
+
+    # any change to the inputs invalidates the cache
+    with open(pathways_copy, "a") as f:
+        f.write("\n")
+    IncytrInput(clusters_copy, pathways_copy, use_cache=True)
+
+    assert load_spy.call_count == 2
+
+
+def test_pathways_cache_rewrite_while_loading(tmp_path, clusters, pathways, mocker):
+    clusters_copy = shutil.copy(clusters, str(tmp_path / "clusters.csv"))
+    pathways_copy = shutil.copy(pathways, str(tmp_path / "pathways.csv"))
+
+    load = IncytrInput.load
+
+    def load_then_rewrite(self, *args, **kwargs):
+        load(self, *args, **kwargs)
+        with open(pathways_copy, "a") as f:
+            f.write("\n")
+
+    mocker.patch.object(IncytrInput, "load", load_then_rewrite)
+    IncytrInput(clusters_copy, pathways_copy, use_cache=True)
+    mocker.stopall()
+
+    # the data read before the rewrite is not served for the new file
+    load_spy = mocker.spy(IncytrInput, "load")
+    IncytrInput(clusters_copy, pathways_copy, use_cache=True)
+    assert load_spy.call_count == 1
+
+
+def test_parallel_load(clusters, pathways, mocker):
+    ranges = byte_ranges(pathways, 4)
+    assert len(ranges) == 4
+    assert all(e == s for (_, e), (s, _) in zip(ranges[:-1], ranges[1:]))
+
+    single = IncytrInput(clusters, pathways, load_workers=1)
+
+    mocker.patch("incytr_viz.ingest.MIN_RANGE_BYTES", 1024)
+    parallel = IncytrInput(clusters, pathways, load_workers=4)
+
+    pd.testing.assert_frame_equal(single.paths, parallel.paths)
+
+
+def test_filter_pathways_dedup(incytr_input):
+    a, b = incytr_input.group_a, incytr_input.group_b
+    raw = pd.DataFrame(
+        {
+            "Path": [
+                "L1*R1*E1*T1",
+                "L1*R1*E1*T1",
+                "L1 *R1*E1*T1",
+                "L1*R1*E1*T1",
+                "L2*R2*E2",
+                None,
+            ],
+            "Sender": ["Neuron", "neuron ", "Neuron", "NEURON", "Neuron", "Neuron"],
+            "Receiver": ["Astro", "astro", "Micro", "Astro", "Astro", "Astro"],
+            "aFC": [np.nan, 0.5, 0.2, 0.7, 0.1, 0.1],
+            f"sigprob_{a}": [0.1, 0.9, 0.9, 0.9, 0.9, 0.9],
+            f"sigprob_{b}": [0.1, 0.2, 0.3, 0.3, 0.3, 0.3],
+        }
+    )
+    raw["Path"] = raw["Path"].astype("str")
+    incytr_input.has_kinase = False
+
+    paths = incytr_input.filter_pathways(raw)
+
+    # rows with a missing afc go before dedup, so the first valid copy is kept; the
+    # key is the genes and cell types, not the other values
+    assert list(paths["afc"]) == [0.5, 0.2]
+    assert list(paths["ligand"]) == ["L1", "L1"]
+    assert list(paths["sender"]) == ["neuron", "neuron"]
+    assert list(paths["receiver"]) == ["astro", "micro"]
+
+
+def test_load_filter(clusters, pathways):
+    full = IncytrInput(clusters, pathways)
+    a, b = full.group_a, full.group_b
+    cell_type = full.paths["sender"].iloc[0]
+    gene = full.paths["ligand"].value_counts().index[0]
+
+    load_filter = LoadFilter(
+        min_sigprob=0.5,
+        cell_types=[cell_type.upper()],
+        genes=[gene, "not a gene"],
+    )
+    filtered = IncytrInput(clusters, pathways, load_filter=load_filter)
+
+    paths = full.paths
+    expected = paths[
+        ((paths["sigprob_" + a] >= 0.5) | (paths["sigprob_" + b] >= 0.5))
+        & (paths["sender"] == cell_type)
+        & (paths["receiver"] == cell_type)
+        & (paths[GENE_COLUMNS] == gene).any(axis=1)
+    ]
+
+    assert 0 < len(filtered.paths) < len(paths)
+    assert list(filtered.filter_engine.path_keys()) == list(
+        full.filter_engine.path_keys(expected.index.to_numpy())
+    )
+
+    with pytest.raises(ValueError):
+        IncytrInput(
+            clusters, pathways, load_filter=LoadFilter(exclude_cell_types=[cell_type])
+        )
+
+
+def test_compact_dtypes(clusters, pathways, tmp_path):
+    # a sigprob just below the 0.7 threshold, which float32 would round up to 0.7
+    with open(pathways) as f:
+        text = f.read()
+    text = text.replace("0.819899544,0.465168271", "0.69999999,0.69999999", 1)
+    pathways_copy = str(tmp_path / "pathways.csv")
+    with open(pathways_copy, "w") as f:
+        f.write(text)
+
+    full = IncytrInput(clusters, pathways_copy)
+    compact = IncytrInput(clusters, pathways_copy, compact_dtypes=True)
+
+    sigprob = "sigprob_" + compact.group_a
+    assert compact.paths[sigprob].dtype == np.float32
+    assert compact.paths["afc"].dtype == np.float32
+    # p values keep full precision, integer columns are narrowed exactly
+    assert compact.paths["p_value_5x"].dtype == np.float64
+    assert full.paths["p_value_wt"].dtype == np.int64
+    assert compact.paths["p_value_wt"].dtype == np.int8
+
+    def rows(inp, **filters):
+        return (
+            PathwaysFilter(
+                all_paths=inp.paths,
+                group_a_name=inp.group_a,
+                group_b_name=inp.group_b,
+                filter_afc_direction=True,
+                engine=inp.filter_engine,
+                **filters,
+            )
+            .filter_result("a")
+            .rows
+        )
+
+    # thresholds are compared in float32 too, whether the sorted index or a scan
+    # answers, so 0.69999999 counts as 0.7 in compact mode only
+    values = compact.paths[sigprob].to_numpy()
+    afc_mask = compact.filter_engine.afc_masks["a"]
+    for threshold in [0.5, 0.7, 0.95, 0.99]:
+        expected = np.flatnonzero(afc_mask & (values >= np.float32(threshold)))
+        assert np.array_equal(rows(compact, sp_threshold=threshold), expected)
+    assert 0 in rows(compact, sp_threshold=0.7)
+    assert 0 not in rows(full, sp_threshold=0.7)
+
+    # thresholds are not truncated to an integer column's type
+    assert np.array_equal(
+        rows(full, pval_threshold=0.5), rows(compact, pval_threshold=0.5)
+    )
+    assert len(rows(compact, pval_threshold=0.5)) > 0
+
+    df = pd.DataFrame(
+        {
+            "p_value_x": [1e-60, 0.5],
+            "q": [0.25, 0.5],
+            "r": [0.69999999, 0.5],
+            "s": [1e-60, 0.5],
+            "i": np.array([0, 1], dtype=np.int64),
+            "bits": np.array([0, 3], dtype=np.uint8),
+        }
+    )
+    df = to_compact_dtypes(df)
+    assert df["p_value_x"].dtype == np.float64
+    assert df["q"].dtype == np.float32
+    assert df["r"].dtype == np.float32
+    # 1e-60 would become 0 as float32
+    assert df["s"].dtype == np.float64
+    assert df["i"].dtype == np.int8
+    assert df["bits"].dtype == np.uint8
+
+
+def test_kinase_bits():
+    paths = pd.DataFrame(
+        {
+            "path": ["p0", "p1", "p2", "p3"],
+            **{col: ["", "", "", ""] for col in KINASE_COLUMNS},
+        }
+    )
+    paths["sik_r_of_em"] = ["Epha7", np.nan, "NA", "Ntrk3"]
+    paths["sik_em_of_r"] = ["Prkcb", "", "Prkcb", "0"]
+
+    encoded, names = KinaseNames.encode(paths)
+
+    assert list(encoded.columns) == ["path", "sik_bits"]
+    bits = encoded["sik_bits"].to_numpy()
+    assert bits.dtype == np.uint8
+    assert list(bits) == [
+        kinase_bit("sik_r_of_em") | kinase_bit("sik_em_of_r"),
+        0,
+        kinase_bit("sik_em_of_r"),
+        kinase_bit("sik_r_of_em"),
+    ]
+
+    rows = np.array([3, 0, 2])
+    assert list(names.lookup("sik_r_of_em", rows)) == ["Ntrk3", "Epha7", ""]
+    assert list(names.lookup("sik_em_of_r", rows)) == ["", "Prkcb", "Prkcb"]
+    assert list(names.lookup("sik_t_of_em", rows)) == ["", "", ""]
+
+
+def test_dataset_registry(clusters, pathways, tmp_path):
+    for name in ["first", "second"]:
+        os.makedirs(tmp_path / name)
+        shutil.copy(clusters, tmp_path / name / "clusters.csv")
+        shutil.copy(pathways, tmp_path / name / "pathways.csv")
+    # incomplete datasets are skipped
+    os.makedirs(tmp_path / "incomplete")
+    shutil.copy(clusters, tmp_path / "incomplete" / "clusters.csv")
+
+    assert list(discover_datasets(tmp_path)) == ["first", "second"]
+
+    # a budget this small keeps only the dataset in use
+    registry = DatasetRegistry(tmp_path, max_memory_mb=0)
+    assert registry.default() == "first"
+
+    first = registry.get("first")
+    assert registry.get("first") is first
+    assert first.memory_usage() > 0
+
+    second = registry.get("second")
+    assert second is not first
+    assert registry.stats()["loaded"] == ["second"]
+    # the default does not follow what was viewed last
+    assert registry.default() == "first"
+
+    assert registry.get("first") is not first
+    assert registry.stats()["loads"] == 3
+    assert registry.stats()["evictions"] == 2
+
+    with pytest.raises(KeyError):
+        registry.get("incomplete")
+
+    # the budget is also checked when a loaded dataset is used again
+    registry = DatasetRegistry(tmp_path)
+    registry.get("first")
+    registry.get("second")
+    assert registry.stats()["loaded"] == ["first", "second"]
+    registry.max_bytes = 0
+    registry.get("first")
+    assert registry.stats()["loaded"] == ["first"]
+    assert registry.stats()["evictions"] == 1
+
+
+def test_reloadable_input(clusters, pathways, tmp_path):
+    shutil.copy(clusters, tmp_path / "clusters.csv")
+    shutil.copy(pathways, tmp_path / "pathways.csv")
+
+    dataset = ReloadableInput(
+        str(tmp_path / "clusters.csv"), str(tmp_path / "pathways.csv")
+    )
+    swapped = []
+    dataset.on_swap.append(swapped.append)
+    before = dataset.current
+
+    assert dataset.reload() is None
+
+    # rewrite the pathways file with half of its rows
+    with open(pathways) as f:
+        lines = f.readlines()
+    with open(tmp_path / "pathways.csv", "w") as f:
+        f.writelines(lines[: len(lines) // 2])
+    os.utime(tmp_path / "pathways.csv", ns=(0, 0))
+
+    # a change is only reloaded once it has settled
+    assert dataset.reload() is None
+    dataset.reload().join()
+
+    assert dataset.current is not before
+    assert swapped == [dataset.current]
+    assert len(dataset.current.paths) < len(before.paths)
+    # requests holding the previous data can still use it
+    assert len(before.filter_engine.group_frame("a")) > 0
+
+    # a failed reload keeps serving the current data
+    with open(tmp_path / "pathways.csv", "w") as f:
+        f.write("not,a,pathways,file\n")
+    dataset.reload(force=True).join()
+    assert dataset.current is swapped[-1]
+    assert dataset.reload() is None
+
+
+def test_gunicorn_reload_keeps_options():
+    pytest.importorskip("gunicorn")
+    from incytr_viz.wsgi_posix import StandaloneApplication, gunicorn_options
+
+    options = gunicorn_options(workers=3, threads=2, worker_class="gthread")
+    g_app = StandaloneApplication(app=None, options=options)
+    # what Arbiter.reload does with the config
+    g_app.reload()
+
+    assert g_app.cfg.workers == 3
+    assert g_app.cfg.threads == 2
+    assert g_app.cfg.worker_class_str == "gthread"
+    assert g_app.cfg.loglevel == "warning"
+
+
+def test_arbiter_during_reload(clusters, pathways, mocker):
+    pytest.importorskip("gunicorn")
+    from gunicorn.arbiter import Arbiter
+    from incytr_viz.wsgi_posix import (
+        CustomArbiter,
+        StandaloneApplication,
+        gunicorn_options,
+    )
+
+    source = ReloadableInput(clusters, pathways)
+    mocker.patch("incytr_viz.wsgi_posix.input_source", return_value=source)
+    options = dict(gunicorn_options(), preload_app=False)
+    arbiter = CustomArbiter(StandaloneApplication(app=None, options=options))
+    mocker.patch.object(arbiter, "wakeup")
+    manage = mocker.patch.object(Arbiter, "manage_workers")
+    reload = mocker.patch.object(Arbiter, "reload")
+    gc = mocker.patch("incytr_viz.wsgi_posix.gc")
+
+    release = threading.Event()
+    build = source._build
+    mocker.patch.object(
+        source, "_build", side_effect=lambda: release.wait() and build()
+    )
+    thread = source.reload(force=True)
+
+    # workers that exit are still replaced while the reload thread runs
+    arbiter.manage_workers()
+    manage.assert_called_once()
+    assert not reload.called
+
+    # once the new data is in, a new set of workers replaces the old ones
+    release.set()
+    thread.join()
+    arbiter.manage_workers()
+    reload.assert_called_once()
+    manage.assert_called_once()
+    assert gc.mock_calls == [
+        mocker.call.unfreeze(),
+        mocker.call.collect(),
+        mocker.call.freeze(),
+    ]
+
+    arbiter.manage_workers()
+    assert manage.call_count == 2
+    reload.assert_called_once()
+
+
+def test_reload_does_not_fork(clusters, pathways, tmp_path, mocker):
+    shutil.copy(clusters, tmp_path / "clusters.csv")
+    shutil.copy(pathways, tmp_path / "pathways.csv")
+    mocker.patch("incytr_viz.ingest.MIN_RANGE_BYTES", 1024)
+
+    dataset = ReloadableInput(
+        str(tmp_path / "clusters.csv"), str(tmp_path / "pathways.csv"), load_workers=4
+    )
+
+    fork = os.fork
+    forked_from = []
+
+    def record_fork():
+        forked_from.append(threading.current_thread())
+        return fork()
+
+    mocker.patch("os.fork", side_effect=record_fork)
+    pool = mocker.spy(incytr_viz.ingest, "ProcessPoolExecutor")
+
+    dataset.reload(force=True).join()
+
+    # the ranges were parsed in processes started by a forkserver
+    assert pool.call_args.kwargs["mp_context"].get_start_method() == "forkserver"
+    assert all(t is threading.main_thread() for t in forked_from)
+    assert dataset.reloads == 1
+    pd.testing.assert_frame_equal(
+        dataset.current.paths, IncytrInput(clusters, pathways).paths
+    )
+
+
+def test_column_store(tmp_path):
+    df = pd.DataFrame(
+        {
+            "afc": [0.5, -1.0, np.nan],
+            "flag": np.array([1, 0, 1], dtype=np.int8),
+            "sender": pd.Categorical(["a", "b", "a"]),
+            "path": pd.array(["x*y", None, "x*y"], dtype="str"),
+        }
+    )
+
+    store = str(tmp_path / "paths")
+    write_column_store(store, df)
+    mapped = read_column_store(store)
+
+    pd.testing.assert_frame_equal(mapped, df)
+    # numeric columns are read-only views of the mapped files
+    assert not mapped["afc"].to_numpy().flags.writeable
+
+
+def test_categorical_components(incytr_input):
+    paths = incytr_input.paths
+
+    for col in ["ligand", "receptor", "em", "target", "sender", "receiver"]:
+        assert isinstance(paths[col].dtype, pd.CategoricalDtype)
+
+    # genes share one dictionary, cell types another
+    assert paths["ligand"].dtype == paths["target"].dtype
+    assert paths["sender"].dtype == paths["receiver"].dtype
+
+
 def test_no_p_value(no_p_value):
 
     assert no_p_value.has_p_value == False
@@ -143,6 +609,246 @@ def test_filter_pathways_sigprob(base_pathway_filter: PathwaysFilter):
     )
 
 
+def test_filter_engine_selection(incytr_input):
+
+    ligand = incytr_input.unique_ligands[0]
+
+    pf = PathwaysFilter(
+        all_paths=incytr_input.paths,
+        group_a_name=incytr_input.group_a,
+        group_b_name=incytr_input.group_b,
+        filter_afc_direction=False,
+        filter_ligands=[ligand],
+        engine=incytr_input.filter_engine,
+    )
+
+    filtered_a = pf.filter("a")
+    paths = incytr_input.paths
+
+    assert filtered_a.shape[0] == (paths["ligand"] == ligand).sum()
+    assert "sigprob" in filtered_a.columns
+    assert not any(c.endswith("_" + incytr_input.group_b) for c in filtered_a.columns)
+
+
+def test_filter_result_cache(incytr_input):
+
+    def _filter(**kwargs):
+        return PathwaysFilter(
+            all_paths=incytr_input.paths,
+            group_a_name=incytr_input.group_a,
+            group_b_name=incytr_input.group_b,
+            filter_afc_direction=True,
+            engine=incytr_input.filter_engine,
+            **kwargs,
+        )
+
+    cache = incytr_input.filter_engine.results
+    hits, misses = cache.hits, cache.misses
+
+    first = _filter(sp_threshold=0.5, filter_senders=["b", "a"]).filter_result("a")
+    # selection order does not change the key
+    second = _filter(sp_threshold=0.5, filter_senders=["a", "b"]).filter_result("a")
+
+    assert first is second
+    assert (cache.hits - hits, cache.misses - misses) == (1, 1)
+
+    cache.max_bytes = 0
+    _filter(sp_threshold=0).filter_result("a")
+    assert len(cache) == 0
+
+
+def test_incremental_filter(incytr_input):
+    engine = incytr_input.filter_engine
+    ligands = list(incytr_input.unique_ligands[0:3])
+
+    states = [
+        dict(sp_threshold=0.2),
+        dict(sp_threshold=0.5),  # tighten
+        dict(sp_threshold=0.5, filter_ligands=ligands[0:2]),  # new predicate
+        dict(sp_threshold=0.5, filter_ligands=ligands),  # loosen selection
+        dict(sp_threshold=0.3, filter_ligands=ligands),  # loosen slider
+        dict(sp_threshold=0.3),  # dropped predicate
+    ]
+
+    for state in states:
+        pf = PathwaysFilter(
+            all_paths=incytr_input.paths,
+            group_a_name=incytr_input.group_a,
+            group_b_name=incytr_input.group_b,
+            filter_afc_direction=True,
+            engine=engine,
+            **state,
+        )
+        result = pf.filter_result("a", session_id="test-session")
+        assert np.array_equal(result.rows, engine.rows("a", pf))
+
+
+def test_posting_index():
+    codes = np.array([2, 0, -1, 2, 1, 0, 2])
+    index = PostingIndex(codes, num_categories=3)
+
+    assert list(index.lookup([2])) == [0, 3, 6]
+    assert list(index.lookup([0, 2])) == [0, 1, 3, 5, 6]
+    assert list(index.lookup([-1])) == [2]
+    assert len(index.lookup([])) == 0
+
+
+def test_sorted_index():
+    values = np.array([0.5, np.nan, 0.1, 0.9, 0.5, 0.7])
+    index = SortedIndex(values)
+
+    def _rows(kind, args):
+        return list(index.rows(index.ranges(kind, args)))
+
+    assert _rows("at_least", (0.5,)) == [0, 3, 4, 5]
+    assert _rows("at_most", (0.5,)) == [0, 2, 4]
+    assert _rows("between", (0.2, 0.7)) == [0, 4, 5]
+    assert _rows("outside", (0.1, 0.9)) == [2, 3]
+    assert _rows("outside", (0.8, 0.2)) == [0, 2, 3, 4, 5]
+
+    for kind, args in [("at_least", (0.5,)), ("outside", (0.1, 0.6))]:
+        expected = np.flatnonzero(evaluate_range_predicate(kind, values, args))
+        assert _rows(kind, args) == list(expected)
+
+
+def test_histogram_bins():
+    values = np.array([0.0, 0.1, 0.5, 0.5, 1.0, np.nan, 0.99])
+    edges = histogram_edges([values], num_bins=4)
+    bins = HistogramBins(values, edges)
+
+    assert list(bins.counts()) == list(
+        np.histogram(values[~np.isnan(values)], edges)[0]
+    )
+    assert list(bins.counts(np.array([0, 4, 5]))) == [1, 0, 0, 1]
+
+
+def test_umap_level_of_detail():
+    umap1 = np.array([0.0, 1.0, 2.0, 3.0, np.nan, 5.0])
+    umap2 = np.array([0.0, 1.0, 2.0, 3.0, 4.0, 5.0])
+
+    full = UmapLevelOfDetail(umap1, umap2, budget=10)
+    assert not full.downsampled
+    assert list(full.rows()) == [0, 1, 2, 3, 5]
+
+    lod = UmapLevelOfDetail(umap1, umap2, budget=2)
+    assert lod.downsampled
+    overview = lod.rows()
+    assert len(overview) == 2
+
+    # zooming in keeps the points already shown in the viewport
+    zoomed = lod.rows(*umap_viewport({"xaxis.range[0]": 0.5, "xaxis.range[1]": 3.5}))
+    assert set(zoomed) <= {1, 2, 3}
+    assert len(zoomed) == 2
+    assert {r for r in overview if r in {1, 2, 3}} <= set(zoomed)
+
+    group = UmapLevelOfDetail(umap1, umap2, rows=np.array([1, 4, 5]), budget=10)
+    assert list(group.rows()) == [1, 5]
+
+    assert umap_viewport({"autosize": True}) is None
+    assert umap_viewport({"xaxis.autorange": True}) == (None, None)
+
+
+def test_umap_afc_restriction(clusters, pathways, tmp_path):
+    df = pd.read_csv(pathways)
+    df["umap1"] = np.arange(len(df), dtype=float)
+    df["umap2"] = np.arange(len(df), dtype=float)
+    df.to_csv(tmp_path / "pathways.csv", index=False)
+    incytr_input = IncytrInput(clusters, str(tmp_path / "pathways.csv"))
+    assert incytr_input.has_umap
+
+    # without the afc direction filter both groups show every pathway
+    everything = np.arange(len(incytr_input.paths))
+    for group_id in ["a", "b"]:
+        rows = incytr_input.umap_level_of_detail(group_id).rows()
+        assert np.array_equal(rows, everything)
+
+        restricted = incytr_input.umap_level_of_detail(group_id, restrict_afc=True)
+        mask = incytr_input.filter_engine.afc_masks[group_id]
+        assert np.array_equal(restricted.rows(), np.flatnonzero(mask))
+        assert len(restricted.rows()) < len(rows)
+
+
+def test_gunicorn_warms_before_fork(clusters, pathways, tmp_path, mocker):
+    pytest.importorskip("gunicorn")
+    from incytr_viz import wsgi_posix
+    from incytr_viz.app import input_source
+
+    df = pd.read_csv(pathways)
+    df["umap1"] = np.arange(len(df), dtype=float)
+    df["umap2"] = np.arange(len(df), dtype=float)
+    df.to_csv(tmp_path / "pathways.csv", index=False)
+
+    mocker.patch("incytr_viz.wsgi_posix.time.sleep")
+    mocker.patch("incytr_viz.wsgi_posix.gc")
+    g_app = mocker.patch("incytr_viz.wsgi_posix.StandaloneApplication")
+    wsgi_posix.run_gunicorn(str(tmp_path / "pathways.csv"), clusters, workers=2)
+
+    # the workers are forked by g_app.run(), after everything was built
+    app = g_app.call_args.kwargs["app"]
+    incytr_input = input_source(app).current
+    engine = incytr_input.filter_engine
+    assert incytr_input.has_umap and incytr_input.has_kinase
+
+    sorted_indexes = {
+        src
+        for sources in engine.group_sources.values()
+        for name, src in sources.items()
+        if name in engine.RANGE_COLUMNS
+    }
+    assert set(engine._sorted_indexes) == sorted_indexes
+    histogram_bins = {
+        src
+        for sources in engine.group_sources.values()
+        for name, src in sources.items()
+        if name in engine.HISTOGRAM_COLUMNS
+    }
+    assert set(engine._histogram_bins) == histogram_bins
+    assert set(engine._kinase_masks) == set(KINASE_COLUMNS)
+    assert set(incytr_input._umap_lods) == {None, "a", "b"}
+
+    # filtering afterwards builds nothing new
+    PathwaysFilter(
+        all_paths=incytr_input.paths,
+        group_a_name=incytr_input.group_a,
+        group_b_name=incytr_input.group_b,
+        filter_afc_direction=True,
+        sp_threshold=0.7,
+        pval_threshold=0.05,
+        engine=engine,
+    ).filter_result("a")
+    assert set(engine._sorted_indexes) == sorted_indexes
+    assert set(engine._histogram_bins) == histogram_bins
+
+
+def test_fold_sankey_nodes():
+    df = pd.DataFrame(
+        {
+            "ligand": ["L1", "L1", "L1", "L2", "L2", "L3"],
+            "receptor": ["R1", "R2", "R3", "R4", "R5", "R6"],
+        }
+    )
+    keys = {("ligand", "receptor"): np.zeros(len(df), dtype=np.int64)}
+
+    same, folded = fold_sankey_nodes(df, keys, node_budget=10, link_budget=10)
+    assert same is df and folded == {}
+
+    # keeping 3 nodes per layer leaves 5 links, keeping 4 would leave 6
+    out, folded = fold_sankey_nodes(df, keys, node_budget=10, link_budget=5)
+    assert folded == {"receptor": 3}
+    assert list(out["ligand"]) == list(df["ligand"])
+    assert list(out["receptor"]) == ["R1", "R2", "R3"] + ["Other (3)"] * 3
+    assert out.groupby(["ligand", "receptor"], observed=True).ngroups == 5
+
+    out, folded = fold_sankey_nodes(df, keys, node_budget=10, link_budget=3)
+    assert folded == {"ligand": 2, "receptor": 5}
+    assert list(out["ligand"]) == ["L1"] * 3 + ["Other (2)"] * 3
+
+    # links split by color count against the budget
+    colors = {("ligand", "receptor"): np.array([0, 0, 0, 0, 1, 0])}
+    _, folded = fold_sankey_nodes(df, colors, node_budget=10, link_budget=5)
+    assert folded == {"ligand": 2, "receptor": 5}
+
+
 def test_nodes_edges(base_pathway_filter: PathwaysFilter, incytr_input):
     a_clusters = incytr_input.clusters[
         incytr_input.clusters["group"] == incytr_input.group_a
@@ -165,6 +871,64 @@ def test_nodes_edges(base_pathway_filter: PathwaysFilter, incytr_input):
     assert len(a_nodes) == len(a_clusters.index.unique())
 
 
+def test_sender_receiver_counts(incytr_input):
+    engine = incytr_input.filter_engine
+    pf = PathwaysFilter(
+        all_paths=incytr_input.paths,
+        group_a_name=incytr_input.group_a,
+        group_b_name=incytr_input.group_b,
+        filter_afc_direction=True,
+        sp_threshold=0.5,
+        engine=engine,
+    )
+
+    result = pf.filter_result("a")
+    a_paths = engine.group_frame("a", result.rows)
+
+    counts = engine.sender_receiver_counts(result)
+    expected = a_paths.groupby(["sender", "receiver"], observed=True).size()
+
+    assert list(counts.index) == list(expected.index)
+    assert list(counts) == list(expected)
+    assert engine.sender_receiver_counts(result) is counts
+
+    a_clusters = incytr_input.clusters[
+        incytr_input.clusters["group"] == incytr_input.group_a
+    ]
+    nodes = load_nodes(a_clusters, node_scale_factor=2)
+    assert load_edges(
+        nodes, a_paths, 1000, 3, sender_receiver_counts=counts
+    ) == load_edges(nodes, a_paths, 1000, 3)
+
+
+def test_export_archive(incytr_input):
+    pf = PathwaysFilter(
+        all_paths=incytr_input.paths,
+        group_a_name=incytr_input.group_a,
+        group_b_name=incytr_input.group_b,
+        filter_afc_direction=True,
+        sp_threshold=0.5,
+        engine=incytr_input.filter_engine,
+    )
+    rebuilt = PathwaysFilter.from_filter_state(incytr_input, pf.filter_state())
+    assert rebuilt.filter_state() == pf.filter_state()
+
+    group_results = [
+        ("a", "a", pf.filter_result("a")),
+        ("b", "b", pf.filter_result("b")),
+    ]
+    # small chunks, so each file is written in several pieces
+    archive = b"".join(
+        stream_export_archive(incytr_input.filter_engine, group_results, chunk_rows=7)
+    )
+
+    with zipfile.ZipFile(io.BytesIO(archive)) as z:
+        assert z.namelist() == ["a.csv", "b.csv"]
+        for group_id in ["a", "b"]:
+            expected = pf.filter(group_id).to_csv()
+            assert z.read(f"{group_id}.csv").decode("utf-8") == expected
+
+
 # def test_filter_umap():
 #     pass
 
@@ -202,6 +966,27 @@ def one_p_value(datadir):
     return os.path.join(datadir, "one_p_value.csv")
 
 
+def test_download_bad_request(clusters, pathways, incytr_input):
+    server = create_app(pathways_file=pathways, clusters_file=clusters)
+    client = server.test_client()
+
+    assert client.post("/download").status_code == 400
+    assert client.post("/download", data={"request": "{not json"}).status_code == 400
+    assert client.post("/download", data={"request": "[]"}).status_code == 400
+
+    pf = PathwaysFilter(
+        all_paths=incytr_input.paths,
+        group_a_name=incytr_input.group_a,
+        group_b_name=incytr_input.group_b,
+        filter_afc_direction=True,
+        engine=incytr_input.filter_engine,
+    )
+    export_request = json.dumps({"filter": pf.filter_state()})
+    response = client.post("/download", data={"request": export_request})
+    assert response.status_code == 200
+    assert response.mimetype == "application/zip"
+
+
 def test_create_apps(no_kinase, no_ppds, no_sigprob, no_tpds, one_p_value, clusters):
     create_app(clusters_file=clusters, pathways_file=no_kinase)
     create_app(clusters_file=clusters, pathways_file=no_ppds)